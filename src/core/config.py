@@ -2,12 +2,26 @@
 Configuration loader for Vision Insight API.
 """
 
+import functools
+import hashlib
+import json
 import os
 import yaml
 from pathlib import Path
 from pydantic import BaseModel, Field
 from typing import Dict, Optional
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    # libyaml-backed loader is several times faster than the pure-Python one.
+    from yaml import CSafeLoader as _Loader
+except ImportError:
+    from yaml import SafeLoader as _Loader
+
 
 class ModelConfig(BaseModel):
     """Configuration for a single model."""
@@ -30,6 +44,8 @@ class MemoryConfig(BaseModel):
     max_unified_memory_gb: float = 24.0
     eviction_threshold_percent: int = 75
     safety_margin_gb: float = 4.0
+    # Evict until freed >= shortfall * factor (>1.0 = more aggressive)
+    eviction_factor: float = 1.0
 
 
 class WorkerPortsConfig(BaseModel):
@@ -52,6 +68,8 @@ class WorkersConfig(BaseModel):
     health_check_interval: int = 30
     health_check_timeout: int = 5
     startup_timeout: int = 120
+    # Gateway reuses a worker handle without re-acquiring it for this many seconds
+    touch_ttl: float = 5.0
 
 
 class AppConfig(BaseModel):
@@ -62,14 +80,58 @@ class AppConfig(BaseModel):
     workers: WorkersConfig = Field(default_factory=WorkersConfig)
 
 
+def _cache_path(path: Path) -> Path:
+    return path.with_name(path.name + ".json")
+
+
+def _source_digest(raw: bytes) -> str:
+    return hashlib.blake2b(raw, digest_size=16).hexdigest()
+
+
+def _load_cached(path: Path, digest: str) -> Optional[dict]:
+    """Return parsed config from the JSON sidecar if it was built from these YAML bytes.
+
+    Keyed on a hash of the YAML rather than mtimes, which a copied/restored
+    file or a coarse-mtime filesystem can get wrong.
+    """
+    try:
+        raw = _cache_path(path).read_bytes()
+        cached = orjson.loads(raw) if orjson else json.loads(raw)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(cached, dict) or cached.get("source_digest") != digest:
+        return None
+    return cached.get("config")
+
+
+def _write_cache(path: Path, data: dict, digest: str) -> None:
+    """Write the JSON sidecar; failures (e.g. read-only mounts) are ignored."""
+    cache = _cache_path(path)
+    tmp = cache.with_name(f"{cache.name}.{os.getpid()}.tmp")
+    payload = {"source_digest": digest, "config": data}
+    try:
+        raw = orjson.dumps(payload) if orjson else json.dumps(payload).encode()
+        tmp.write_bytes(raw)
+        os.replace(tmp, cache)
+    except (OSError, TypeError):
+        try:
+            tmp.unlink()
+        except OSError:
+            pass
+
+
 def load_config(config_path: str = "config.yaml") -> AppConfig:
     """Load configuration from YAML file."""
     path = Path(config_path)
     if not path.exists():
         raise FileNotFoundError(f"Config file not found: {config_path}")
 
-    with open(path, "r") as f:
-        data = yaml.safe_load(f)
+    source = path.read_bytes()
+    digest = _source_digest(source)
+    data = _load_cached(path, digest)
+    if data is None:
+        data = yaml.load(source, Loader=_Loader)
+        _write_cache(path, data, digest)
 
     cfg = AppConfig(**data)
 
@@ -82,5 +144,14 @@ def load_config(config_path: str = "config.yaml") -> AppConfig:
     return cfg
 
 
-# Global config instance
-config = load_config()
+@functools.lru_cache(maxsize=1)
+def get_config() -> AppConfig:
+    """Return the process-wide config, loading it on first use."""
+    return load_config()
+
+
+def __getattr__(name: str):
+    # Backward compatibility for `from src.core.config import config`.
+    if name == "config":
+        return get_config()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -3,14 +3,24 @@ Memory Manager for model allocation.
 Supports Apple Silicon unified memory (macOS) and NVIDIA GPU memory (Linux).
 """
 
+import atexit
+import ctypes
+import functools
+import heapq
 import platform
 import subprocess
 import re
+import time
 from dataclasses import dataclass
 from typing import Dict, Optional
 
+try:
+    import pynvml
+except ImportError:
+    pynvml = None
 
-@dataclass
+
+@dataclass(slots=True)
 class MemoryStatus:
     """Current memory status in GB."""
     total: float
@@ -50,6 +60,17 @@ MODEL_MEMORY_REQUIREMENTS: Dict[str, float] = {
 }
 
 
+# Estimates by model name pattern, checked in order (first match wins)
+MODEL_SIZE_PATTERNS: tuple[tuple[str, float], ...] = (
+    ("14b", 8.0),
+    ("7b", 4.5),
+    ("3b", 2.5),
+    ("2b", 1.5),
+    ("1b", 1.5),
+)
+
+
+@functools.lru_cache(maxsize=128)
 def get_model_memory_requirement(model_path: str, model_type: str = "vlm") -> float:
     """Get estimated memory requirement for a model."""
     if model_path in MODEL_MEMORY_REQUIREMENTS:
@@ -57,15 +78,9 @@ def get_model_memory_requirement(model_path: str, model_type: str = "vlm") -> fl
 
     # Estimate based on model name patterns
     path_lower = model_path.lower()
-
-    if "14b" in path_lower:
-        return 8.0
-    elif "7b" in path_lower:
-        return 4.5
-    elif "3b" in path_lower:
-        return 2.5
-    elif "2b" in path_lower or "1b" in path_lower:
-        return 1.5
+    for needle, gb in MODEL_SIZE_PATTERNS:
+        if needle in path_lower:
+            return gb
 
     # Fallback by type
     if model_type == "diffusion":
@@ -73,23 +88,24 @@ def get_model_memory_requirement(model_path: str, model_type: str = "vlm") -> fl
     return MODEL_MEMORY_REQUIREMENTS["_default_vlm"]
 
 
+_MEMINFO_RE = re.compile(rb"^(MemTotal|MemAvailable|Buffers|Cached):\s+(\d+)", re.M)
+
+
 def _get_linux_memory_status() -> MemoryStatus:
     """Get memory status on Linux using /proc/meminfo."""
     try:
-        with open("/proc/meminfo") as f:
-            meminfo = {}
-            for line in f:
-                parts = line.split(":")
-                if len(parts) == 2:
-                    key = parts[0].strip()
-                    val = parts[1].strip().split()[0]  # kB value
-                    meminfo[key] = int(val) / (1024 * 1024)  # Convert to GB
-
-        total = meminfo.get("MemTotal", 32.0)
-        available = meminfo.get("MemAvailable", total * 0.5)
+        with open("/proc/meminfo", "rb", buffering=0) as f:
+            data = f.read()
+        meminfo = {
+            m.group(1): int(m.group(2)) / 1048576.0  # kB -> GB
+            for m in _MEMINFO_RE.finditer(data)
+        }
+
+        total = meminfo.get(b"MemTotal", 32.0)
+        available = meminfo.get(b"MemAvailable", total * 0.5)
         used = total - available
-        buffers = meminfo.get("Buffers", 0)
-        cached = meminfo.get("Cached", 0)
+        buffers = meminfo.get(b"Buffers", 0)
+        cached = meminfo.get(b"Cached", 0)
 
         return MemoryStatus(
             total=round(total, 2),
@@ -103,20 +119,62 @@ def _get_linux_memory_status() -> MemoryStatus:
         return _get_fallback_memory_status()
 
 
+# NVML device handles, initialized once on first use (empty list = NVML unavailable)
+_nvml_handles: Optional[list] = None
+
+
+def _init_nvml() -> list:
+    """Initialize NVML once and cache device handles."""
+    global _nvml_handles
+    if _nvml_handles is not None:
+        return _nvml_handles
+
+    _nvml_handles = []
+    if pynvml is None:
+        return _nvml_handles
+
+    try:
+        pynvml.nvmlInit()
+        _nvml_handles = [
+            pynvml.nvmlDeviceGetHandleByIndex(i)
+            for i in range(pynvml.nvmlDeviceGetCount())
+        ]
+        atexit.register(pynvml.nvmlShutdown)
+    except Exception:
+        _nvml_handles = []
+    return _nvml_handles
+
+
 def _get_nvidia_gpu_memory() -> list[dict]:
-    """Get NVIDIA GPU memory info via nvidia-smi."""
+    """Get NVIDIA GPU memory info via NVML, falling back to nvidia-smi."""
+    handles = _init_nvml()
+    if handles:
+        try:
+            gpus = []
+            for index, handle in enumerate(handles):
+                info = pynvml.nvmlDeviceGetMemoryInfo(handle)
+                gpus.append({
+                    "index": index,
+                    "total_mb": info.total / (1024 * 1024),
+                    "used_mb": info.used / (1024 * 1024),
+                    "free_mb": info.free / (1024 * 1024),
+                })
+            return gpus
+        except Exception:
+            pass
+
     try:
         result = subprocess.run(
             ["nvidia-smi", "--query-gpu=index,memory.total,memory.used,memory.free",
              "--format=csv,noheader,nounits"],
-            capture_output=True, text=True, timeout=5,
+            capture_output=True, timeout=5,
         )
         if result.returncode != 0:
             return []
 
         gpus = []
-        for line in result.stdout.strip().split("\n"):
-            parts = [x.strip() for x in line.split(",")]
+        for line in result.stdout.strip().split(b"\n"):
+            parts = line.split(b",")
             if len(parts) == 4:
                 gpus.append({
                     "index": int(parts[0]),
@@ -129,36 +187,203 @@ def _get_nvidia_gpu_memory() -> list[dict]:
         return []
 
 
-def get_memory_status() -> MemoryStatus:
+# Bursts of admission checks share one reading within this window
+MEMORY_STATUS_TTL_SECONDS = 0.25
+_cached_status: Optional[tuple[float, MemoryStatus]] = None
+
+
+def get_memory_status(force: bool = False) -> MemoryStatus:
     """
     Get current memory status.
     Uses /proc/meminfo on Linux, vm_stat on macOS.
     Returns memory values in GB.
+
+    Readings are cached for MEMORY_STATUS_TTL_SECONDS; pass force=True
+    to bypass the cache.
     """
+    global _cached_status
+    now = time.monotonic()
+    if not force and _cached_status is not None:
+        ts, status = _cached_status
+        if now - ts < MEMORY_STATUS_TTL_SECONDS:
+            return status
+
+    status = _read_memory_status()
+    _cached_status = (now, status)
+    return status
+
+
+def _read_memory_status() -> MemoryStatus:
+    """Read memory status from the OS (uncached)."""
     if IS_LINUX:
         return _get_linux_memory_status()
 
+    status = _get_macos_native_memory_status()
+    if status is not None:
+        return status
+    return _get_vm_stat_memory_status()
+
+
+# === macOS native (libSystem) memory stats ===
+
+_HOST_VM_INFO64 = 4
+
+
+class _VMStatistics64(ctypes.Structure):
+    """vm_statistics64_data_t from <mach/vm_statistics.h>."""
+    _fields_ = [
+        ("free_count", ctypes.c_uint32),
+        ("active_count", ctypes.c_uint32),
+        ("inactive_count", ctypes.c_uint32),
+        ("wire_count", ctypes.c_uint32),
+        ("zero_fill_count", ctypes.c_uint64),
+        ("reactivations", ctypes.c_uint64),
+        ("pageins", ctypes.c_uint64),
+        ("pageouts", ctypes.c_uint64),
+        ("faults", ctypes.c_uint64),
+        ("cow_faults", ctypes.c_uint64),
+        ("lookups", ctypes.c_uint64),
+        ("hits", ctypes.c_uint64),
+        ("purges", ctypes.c_uint64),
+        ("purgeable_count", ctypes.c_uint32),
+        ("speculative_count", ctypes.c_uint32),
+        ("decompressions", ctypes.c_uint64),
+        ("compressions", ctypes.c_uint64),
+        ("swapins", ctypes.c_uint64),
+        ("swapouts", ctypes.c_uint64),
+        ("compressor_page_count", ctypes.c_uint32),
+        ("throttled_count", ctypes.c_uint32),
+        ("external_page_count", ctypes.c_uint32),
+        ("internal_page_count", ctypes.c_uint32),
+        ("total_uncompressed_pages_in_compressor", ctypes.c_uint64),
+    ]
+
+
+_HOST_VM_INFO64_COUNT = ctypes.sizeof(_VMStatistics64) // ctypes.sizeof(ctypes.c_int32)
+
+_libsystem = None
+if IS_MACOS:
+    try:
+        _libsystem = ctypes.CDLL("/usr/lib/libSystem.dylib")
+        _libsystem.sysctlbyname.argtypes = [
+            ctypes.c_char_p, ctypes.c_void_p, ctypes.POINTER(ctypes.c_size_t),
+            ctypes.c_void_p, ctypes.c_size_t,
+        ]
+        _libsystem.sysctlbyname.restype = ctypes.c_int
+        _libsystem.mach_host_self.argtypes = []
+        _libsystem.mach_host_self.restype = ctypes.c_uint32
+        _libsystem.host_statistics64.argtypes = [
+            ctypes.c_uint32, ctypes.c_int, ctypes.POINTER(_VMStatistics64),
+            ctypes.POINTER(ctypes.c_uint32),
+        ]
+        _libsystem.host_statistics64.restype = ctypes.c_int
+    except (OSError, AttributeError):
+        _libsystem = None
+
+
+def _sysctl_int(name: bytes) -> Optional[int]:
+    """Read an integer sysctl via sysctlbyname (no subprocess)."""
+    if _libsystem is None:
+        return None
+    value = ctypes.c_uint64(0)
+    size = ctypes.c_size_t(ctypes.sizeof(value))
+    if _libsystem.sysctlbyname(name, ctypes.byref(value), ctypes.byref(size), None, 0) != 0:
+        return None
+    return value.value
+
+
+def _get_macos_native_memory_status() -> Optional[MemoryStatus]:
+    """Get memory status on macOS via sysctlbyname + host_statistics64."""
+    if _libsystem is None:
+        return None
+    try:
+        total_bytes = _sysctl_int(b"hw.memsize")
+        page_size = _sysctl_int(b"hw.pagesize")
+        if not total_bytes or not page_size:
+            return None
+
+        stats = _VMStatistics64()
+        count = ctypes.c_uint32(_HOST_VM_INFO64_COUNT)
+        host = _libsystem.mach_host_self()
+        if _libsystem.host_statistics64(host, _HOST_VM_INFO64, ctypes.byref(stats), ctypes.byref(count)) != 0:
+            return None
+
+        return _macos_memory_status(
+            total_bytes,
+            page_size,
+            free_pages=stats.free_count,
+            active_pages=stats.active_count,
+            inactive_pages=stats.inactive_count,
+            speculative_pages=stats.speculative_count,
+            wired_pages=stats.wire_count,
+            compressed_pages=stats.compressor_page_count,
+            purgeable_pages=stats.purgeable_count,
+        )
+    except Exception:
+        return None
+
+
+def _macos_memory_status(
+    total_bytes: int,
+    page_size: int,
+    free_pages: int,
+    active_pages: int,
+    inactive_pages: int,
+    speculative_pages: int,
+    wired_pages: int,
+    compressed_pages: int,
+    purgeable_pages: int,
+) -> MemoryStatus:
+    """Build a MemoryStatus from macOS VM page counts."""
+    total_gb = total_bytes / (1024 ** 3)
+
+    # Calculate memory components (convert pages to GB)
+    def pages_to_gb(pages: int) -> float:
+        return (pages * page_size) / (1024 ** 3)
+
+    # App memory = active + inactive (excluding wired/system)
+    app_memory_gb = pages_to_gb(active_pages + inactive_pages)
+
+    # Wired memory (kernel, system)
+    wired_gb = pages_to_gb(wired_pages)
+
+    # Compressed
+    compressed_gb = pages_to_gb(compressed_pages)
+
+    # Available = free + purgeable + speculative (can be reclaimed)
+    available_gb = pages_to_gb(free_pages + purgeable_pages + speculative_pages + inactive_pages)
+
+    # Used = total - available
+    used_gb = total_gb - available_gb
+
+    return MemoryStatus(
+        total=round(total_gb, 2),
+        used=round(used_gb, 2),
+        available=round(available_gb, 2),
+        app_memory=round(app_memory_gb, 2),
+        wired=round(wired_gb, 2),
+        compressed=round(compressed_gb, 2),
+    )
+
+
+_VM_STAT_RE = re.compile(rb"^([^:\n]+):[^\d\n]*(\d+)", re.M)
+
+
+def _get_vm_stat_memory_status() -> MemoryStatus:
+    """Get memory status on macOS by parsing vm_stat (subprocess fallback)."""
     try:
         # Get vm_stat output
         result = subprocess.run(
             ["vm_stat"],
             capture_output=True,
-            text=True,
             timeout=5
         )
 
         if result.returncode != 0:
             return _get_fallback_memory_status()
 
-        # Parse vm_stat output
-        stats = {}
-        for line in result.stdout.split("\n"):
-            if ":" in line:
-                key, value = line.split(":", 1)
-                # Extract number, removing periods and converting
-                match = re.search(r"(\d+)", value.strip())
-                if match:
-                    stats[key.strip()] = int(match.group(1))
+        # Parse vm_stat output ("Pages free:    12345." -> {b"Pages free": 12345})
+        stats = {m.group(1): int(m.group(2)) for m in _VM_STAT_RE.finditer(result.stdout)}
 
         # vm_stat reports in pages (usually 16384 bytes = 16KB on Apple Silicon)
         page_size = 16384  # bytes
@@ -167,46 +392,20 @@ def get_memory_status() -> MemoryStatus:
         sysctl_result = subprocess.run(
             ["sysctl", "-n", "hw.memsize"],
             capture_output=True,
-            text=True,
             timeout=5
         )
         total_bytes = int(sysctl_result.stdout.strip())
-        total_gb = total_bytes / (1024 ** 3)
-
-        # Calculate memory components (convert pages to GB)
-        def pages_to_gb(pages: int) -> float:
-            return (pages * page_size) / (1024 ** 3)
 
-        free_pages = stats.get("Pages free", 0)
-        active_pages = stats.get("Pages active", 0)
-        inactive_pages = stats.get("Pages inactive", 0)
-        speculative_pages = stats.get("Pages speculative", 0)
-        wired_pages = stats.get("Pages wired down", 0)
-        compressed_pages = stats.get("Pages occupied by compressor", 0)
-        purgeable_pages = stats.get("Pages purgeable", 0)
-
-        # App memory = active + inactive (excluding wired/system)
-        app_memory_gb = pages_to_gb(active_pages + inactive_pages)
-
-        # Wired memory (kernel, system)
-        wired_gb = pages_to_gb(wired_pages)
-
-        # Compressed
-        compressed_gb = pages_to_gb(compressed_pages)
-
-        # Available = free + purgeable + speculative (can be reclaimed)
-        available_gb = pages_to_gb(free_pages + purgeable_pages + speculative_pages + inactive_pages)
-
-        # Used = total - available
-        used_gb = total_gb - available_gb
-
-        return MemoryStatus(
-            total=round(total_gb, 2),
-            used=round(used_gb, 2),
-            available=round(available_gb, 2),
-            app_memory=round(app_memory_gb, 2),
-            wired=round(wired_gb, 2),
-            compressed=round(compressed_gb, 2),
+        return _macos_memory_status(
+            total_bytes,
+            page_size,
+            free_pages=stats.get(b"Pages free", 0),
+            active_pages=stats.get(b"Pages active", 0),
+            inactive_pages=stats.get(b"Pages inactive", 0),
+            speculative_pages=stats.get(b"Pages speculative", 0),
+            wired_pages=stats.get(b"Pages wired down", 0),
+            compressed_pages=stats.get(b"Pages occupied by compressor", 0),
+            purgeable_pages=stats.get(b"Pages purgeable", 0),
         )
 
     except Exception as e:
@@ -217,14 +416,16 @@ def get_memory_status() -> MemoryStatus:
 def _get_fallback_memory_status() -> MemoryStatus:
     """Fallback memory status when vm_stat fails."""
     # Try to at least get total memory
+    total_bytes = _sysctl_int(b"hw.memsize")
     try:
-        result = subprocess.run(
-            ["sysctl", "-n", "hw.memsize"],
-            capture_output=True,
-            text=True,
-            timeout=5
-        )
-        total_gb = int(result.stdout.strip()) / (1024 ** 3)
+        if not total_bytes:
+            result = subprocess.run(
+                ["sysctl", "-n", "hw.memsize"],
+                capture_output=True,
+                timeout=5
+            )
+            total_bytes = int(result.stdout.strip())
+        total_gb = total_bytes / (1024 ** 3)
     except Exception:
         total_gb = 32.0  # Assume 32GB as default
 
@@ -290,16 +491,16 @@ def calculate_eviction_needed(
     evict_list = []
     freed_memory = 0.0
 
-    # Sort by memory size descending (evict largest first to minimize evictions)
-    # Could also sort by LRU here if we track usage time
-    sorted_models = sorted(loaded_models.items(), key=lambda x: x[1], reverse=True)
+    # Pop from a max-heap by memory size (evict largest first to minimize evictions);
+    # the index keeps insertion order for ties and stops us comparing aliases.
+    # Could also order by LRU here if we track usage time
+    heap = [(-mem_gb, i, alias) for i, (alias, mem_gb) in enumerate(loaded_models.items())]
+    heapq.heapify(heap)
 
-    for alias, mem_gb in sorted_models:
+    while heap and freed_memory < memory_to_free:
+        neg_mem_gb, _, alias = heapq.heappop(heap)
         evict_list.append(alias)
-        freed_memory += mem_gb
-
-        if freed_memory >= memory_to_free:
-            break
+        freed_memory -= neg_mem_gb
 
     return evict_list
 
@@ -17,7 +17,7 @@ import httpx
 from typing import Dict, Optional
 from dataclasses import dataclass, field
 
-from src.core.config import config
+from src.core.config import get_config
 
 
 # Worker Manager address
@@ -26,7 +26,16 @@ WORKER_MANAGER_PORT = int(os.getenv("WORKER_MANAGER_PORT", "8100"))
 WORKER_MANAGER_URL = f"http://{WORKER_MANAGER_HOST}:{WORKER_MANAGER_PORT}"
 
 
-@dataclass
+class WorkerManagerError(RuntimeError):
+    """Error response returned by the Worker Manager."""
+
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(f"Worker Manager error: {detail}")
+        self.status_code = status_code
+        self.detail = detail
+
+
+@dataclass(slots=True)
 class WorkerInfo:
     """Information about a worker obtained from Worker Manager."""
     alias: str
@@ -43,45 +52,97 @@ class Supervisor:
     This runs inside Docker and communicates with Worker Manager on host.
     """
 
+    # Set once the Worker Manager is found to predate /acquire or /touch-batch
+    _acquire_unsupported = False
+    _touch_batch_unsupported = False
+
     def __init__(self):
         self.workers: Dict[str, WorkerInfo] = {}
-        self.lock = asyncio.Lock()
+        # Per-alias locks so a slow spawn only blocks requests for the same model
+        self._alias_locks: Dict[str, asyncio.Lock] = {}
+        # Pooled clients keyed by worker address, reused across requests
+        self._clients: Dict[str, httpx.AsyncClient] = {}
+        self._manager_client: Optional[httpx.AsyncClient] = None
+        # Requests served from a cached handle, reported to the manager in batches
+        self._pending_touches: Dict[str, int] = {}
+        self._flusher: Optional[asyncio.Task] = None
 
     def _get_worker_url(self, port: int) -> str:
         """Get URL to reach worker from Docker."""
         host = os.getenv("WORKER_HOST", "host.docker.internal")
         return f"http://{host}:{port}"
 
+    def get_client(self, address: str) -> httpx.AsyncClient:
+        """
+        Get a keep-alive client for a worker address (HTTP URL or UDS path).
+
+        Lookup and insert happen without an await in between, so no lock is needed.
+        """
+        client = self._clients.get(address)
+        if client is None:
+            limits = httpx.Limits(max_keepalive_connections=32)
+            if address.startswith("http"):
+                client = httpx.AsyncClient(base_url=address, limits=limits)
+            else:
+                client = httpx.AsyncClient(
+                    transport=httpx.AsyncHTTPTransport(uds=address, limits=limits),
+                    base_url="http://local",
+                )
+            self._clients[address] = client
+        return client
+
+    def _get_manager_client(self) -> httpx.AsyncClient:
+        """Get the long-lived Worker Manager client (created on first use)."""
+        if self._manager_client is None:
+            self._manager_client = httpx.AsyncClient(
+                base_url=WORKER_MANAGER_URL,
+                timeout=httpx.Timeout(10.0, read=120.0),
+            )
+        return self._manager_client
+
     async def _call_manager(self, method: str, path: str, **kwargs) -> dict:
         """Call Worker Manager API."""
-        async with httpx.AsyncClient() as client:
-            url = f"{WORKER_MANAGER_URL}{path}"
-            try:
-                if method == "GET":
-                    resp = await client.get(url, timeout=10.0)
-                else:
-                    resp = await client.post(url, timeout=120.0, **kwargs)
-
-                if resp.status_code >= 400:
-                    error = resp.json().get("detail", resp.text)
-                    raise RuntimeError(f"Worker Manager error: {error}")
-
-                return resp.json()
-            except httpx.ConnectError:
-                raise RuntimeError(
-                    f"Cannot connect to Worker Manager at {WORKER_MANAGER_URL}. "
-                    "Make sure it's running on host."
-                )
+        client = self._get_manager_client()
+        try:
+            if method == "GET":
+                resp = await client.get(path, timeout=10.0)
+            else:
+                resp = await client.post(path, timeout=120.0, **kwargs)
+
+            if resp.status_code >= 400:
+                error = resp.json().get("detail", resp.text)
+                raise WorkerManagerError(resp.status_code, error)
+
+            return resp.json()
+        except httpx.ConnectError:
+            raise RuntimeError(
+                f"Cannot connect to Worker Manager at {WORKER_MANAGER_URL}. "
+                "Make sure it's running on host."
+            )
 
     async def get_worker(self, alias: str) -> WorkerInfo:
         """
         Get a worker, spawning if necessary.
 
-        Calls Worker Manager to ensure worker is running.
+        Calls Worker Manager to ensure worker is running. A handle acquired
+        within workers.touch_ttl seconds is reused without a round trip.
         """
-        async with self.lock:
-            # Ask Worker Manager to spawn (idempotent - returns existing if running)
-            result = await self._call_manager("POST", f"/spawn/{alias}")
+        worker = self._get_fresh_worker(alias)
+        if worker is not None:
+            self._record_touch(alias)
+            return worker
+
+        async with self._get_alias_lock(alias):
+            # Another request may have acquired it while we waited
+            worker = self._get_fresh_worker(alias)
+            if worker is not None:
+                self._record_touch(alias)
+                return worker
+
+            await self.flush_touches()
+
+            # Spawn (idempotent - returns existing if running) and reset idle timer
+            result = await self._acquire(alias)
 
             port = result["port"]
             worker = WorkerInfo(
@@ -92,11 +153,100 @@ class Supervisor:
             )
 
             self.workers[alias] = worker
+            return worker
+
+    def _get_fresh_worker(self, alias: str) -> Optional[WorkerInfo]:
+        """Return the cached handle if it was acquired within touch_ttl."""
+        worker = self.workers.get(alias)
+        if worker is not None and time.time() - worker.last_used < get_config().workers.touch_ttl:
+            return worker
+        return None
+
+    def _record_touch(self, alias: str):
+        """Count a cached-handle hit and make sure a flush is scheduled for it."""
+        self._pending_touches[alias] = self._pending_touches.get(alias, 0) + 1
+        if self._flusher is None or self._flusher.done():
+            self._flusher = asyncio.create_task(self._flush_periodically())
+
+    async def _flush_periodically(self):
+        """Flush touches every touch_ttl while there are any, so the manager's
+        idle timers see traffic even if no request takes the slow path."""
+        while self._pending_touches:
+            await asyncio.sleep(get_config().workers.touch_ttl)
+            await self.flush_touches()
+
+    async def flush_touches(self):
+        """Report requests served from cached handles in one /touch-batch call."""
+        if not self._pending_touches:
+            return
+        pending, self._pending_touches = self._pending_touches, {}
+
+        try:
+            if not Supervisor._touch_batch_unsupported:
+                try:
+                    events = [{"alias": a, "n": n} for a, n in pending.items()]
+                    await self._call_manager("POST", "/touch-batch", json={"events": events})
+                    return
+                except WorkerManagerError as e:
+                    if e.status_code != 404 or e.detail != "Not Found":
+                        raise
+                    Supervisor._touch_batch_unsupported = True
+
+            # Older manager: one touch per alias (counts are approximate)
+            await asyncio.gather(
+                *(self._call_manager("POST", f"/touch/{alias}") for alias in pending)
+            )
+        except Exception as e:
+            print(f"[!] Touch flush error: {e}")
 
-            # Touch to reset idle timer
-            await self._call_manager("POST", f"/touch/{alias}")
+    async def locate_worker(self, alias: str) -> Optional[WorkerInfo]:
+        """
+        Find a running worker without acquiring or touching it.
 
+        Uses the cached handle whatever its age, else the manager's /status.
+        Returns None if the worker is not running.
+        """
+        worker = self.workers.get(alias)
+        if worker is not None:
             return worker
+        info = (await self._call_manager("GET", "/status"))["workers"].get(alias)
+        if info is None:
+            return None
+        port = info["port"]
+        # last_used=0: never treated as fresh by get_worker
+        return WorkerInfo(
+            alias=alias,
+            address=self._get_worker_url(port),
+            port=port,
+            memory_gb=info["memory_gb"],
+            last_used=0.0,
+        )
+
+    def forget_worker(self, alias: str):
+        """Drop a cached handle so the next request re-acquires it."""
+        self.workers.pop(alias, None)
+
+    def _get_alias_lock(self, alias: str) -> asyncio.Lock:
+        """Get (or create) the lock for an alias; no await, so no mutex needed."""
+        lock = self._alias_locks.get(alias)
+        if lock is None:
+            lock = self._alias_locks[alias] = asyncio.Lock()
+        return lock
+
+    async def _acquire(self, alias: str) -> dict:
+        """Spawn + touch in one round trip, falling back to two calls on older managers."""
+        if not Supervisor._acquire_unsupported:
+            try:
+                return await self._call_manager("POST", f"/acquire/{alias}")
+            except WorkerManagerError as e:
+                # Route missing (as opposed to "Unknown model" 404 from the handler)
+                if e.status_code != 404 or e.detail != "Not Found":
+                    raise
+                Supervisor._acquire_unsupported = True
+
+        result = await self._call_manager("POST", f"/spawn/{alias}")
+        await self._call_manager("POST", f"/touch/{alias}")
+        return result
 
     async def stop_worker(self, alias: str):
         """Stop a specific worker."""
@@ -104,18 +254,40 @@ class Supervisor:
         if alias in self.workers:
             del self.workers[alias]
 
+    async def stop_all(self):
+        """Stop all known workers concurrently (one /stop call per alias)."""
+        aliases = list(self.workers)
+        await asyncio.gather(
+            *(self._call_manager("POST", f"/stop/{alias}") for alias in aliases),
+            return_exceptions=True,
+        )
+        for alias in aliases:
+            self.workers.pop(alias, None)
+
     async def get_status(self) -> dict:
         """Get status from Worker Manager."""
         return await self._call_manager("GET", "/status")
 
     async def shutdown(self):
         """Stop all workers."""
+        if self._flusher is not None:
+            self._flusher.cancel()
+            self._flusher = None
+        await self.flush_touches()
         try:
             await self._call_manager("POST", "/stop-all")
         except Exception as e:
             print(f"[!] Shutdown error: {e}")
         self.workers.clear()
 
+        clients = list(self._clients.values())
+        self._clients.clear()
+        if self._manager_client is not None:
+            clients.append(self._manager_client)
+            self._manager_client = None
+        for client in clients:
+            await client.aclose()
+
 
 # Global supervisor instance
 supervisor = Supervisor()
@@ -1,21 +1,117 @@
 from fastapi import FastAPI, HTTPException, Request
-from fastapi.responses import JSONResponse
-from pydantic import BaseModel
-from typing import List, Dict, Any, Optional
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from starlette.background import BackgroundTask
+from pydantic import BaseModel, Field
+from typing import List, Dict, Any, Literal, Optional
 import time
 import asyncio
+import functools
+import json
+import httpx
 from contextlib import asynccontextmanager
 
-import httpx
-from src.core.config import config
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+from src.core.config import get_config
 from src.core.supervisor import supervisor
 
 
 _DEFAULT_API_KEYS = {"default-key", "default-key-change-me"}
 
+# Unknown model names containing these (e.g. OpenAI/Anthropic clients) fall back to vlm-fast
+_REDIRECT_SUBSTRINGS = ("gpt", "claude")
+
+# Analysis tasks routed to the larger VLM; everything else uses vlm-fast
+_TASK_TO_MODEL = {"analyze": "vlm-best", "describe": "vlm-best"}
+
+
+@functools.lru_cache(maxsize=1)
+def _model_names() -> frozenset:
+    """Configured model aliases (config only changes on restart)."""
+    return frozenset(get_config().models)
+
 
 def _get_api_key() -> str:
-    return (config.gateway.api_key or "").strip()
+    return (get_config().gateway.api_key or "").strip()
+
+
+_JSON_HEADERS = {"content-type": "application/json"}
+
+
+def _encode(payload: dict) -> bytes:
+    """Serialize a worker request body straight to bytes (orjson when available)."""
+    if orjson is not None:
+        return orjson.dumps(payload)
+    return json.dumps(payload).encode()
+
+
+def _relay(resp) -> Response:
+    """Pass a worker response body through unchanged (no JSON decode/re-encode)."""
+    return Response(
+        content=resp.content,
+        status_code=resp.status_code,
+        media_type=resp.headers.get("content-type", "application/json"),
+    )
+
+
+# The request never reached the worker: safe to re-acquire and send again
+_STALE_WORKER_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout)
+
+
+async def _send_to_worker(alias: str, send):
+    """
+    Run send(client) against the worker for alias.
+
+    A cached handle can outlive its worker (eviction, idle offload, restart),
+    so a connection failure drops the handle and retries once through a
+    fresh /acquire before failing the request.
+    """
+    for attempt in range(2):
+        worker = await supervisor.get_worker(alias)
+        client = supervisor.get_client(worker.address)
+        try:
+            return await send(client)
+        except _STALE_WORKER_ERRORS as e:
+            supervisor.forget_worker(alias)
+            if attempt == 0:
+                print(f"[!] Worker {alias} unreachable ({e}), re-acquiring")
+                continue
+            raise HTTPException(status_code=500, detail=f"Worker error: {str(e)}")
+        except Exception as e:
+            supervisor.forget_worker(alias)
+            raise HTTPException(status_code=500, detail=f"Worker error: {str(e)}")
+
+
+async def _forward(alias: str, path: str, payload: dict, timeout: float) -> Response:
+    """Resolve the worker for alias, POST payload to path and relay its response."""
+    body = _encode(payload)
+
+    async def send(client):
+        return await client.post(path, content=body, headers=_JSON_HEADERS, timeout=timeout)
+
+    return _relay(await _send_to_worker(alias, send))
+
+
+async def _forward_stream(alias: str, path: str, payload: dict, timeout: float) -> Response:
+    """Like _forward, but relays the worker body chunk by chunk as it is produced."""
+    body = _encode(payload)
+
+    async def send(client):
+        request = client.build_request(
+            "POST", path, content=body, headers=_JSON_HEADERS, timeout=timeout
+        )
+        return await client.send(request, stream=True)
+
+    resp = await _send_to_worker(alias, send)
+    return StreamingResponse(
+        resp.aiter_raw(),
+        status_code=resp.status_code,
+        media_type=resp.headers.get("content-type", "application/json"),
+        background=BackgroundTask(resp.aclose),
+    )
 
 
 @asynccontextmanager
@@ -82,6 +178,11 @@ class ImageGenerationRequest(BaseModel):
     steps: Optional[int] = None
     seed: Optional[int] = None
     guidance: float = 3.5
+    # Optional worker options, forwarded only when set (worker defaults otherwise)
+    preset: Optional[str] = Field(default=None, pattern="^(draft|standard|final)$")
+    format: Optional[str] = Field(default=None, pattern="^(?i:png|jpe?g|webp)$")
+    quality: Optional[int] = Field(default=None, ge=1, le=100)
+    wait: Optional[bool] = None  # False = return a task_id to poll via /v1/images/tasks
 
 
 class ImageEditRequest(BaseModel):
@@ -94,6 +195,23 @@ class ImageEditRequest(BaseModel):
     steps: Optional[int] = None
     seed: Optional[int] = None
     guidance: float = 3.5
+    preset: Optional[str] = Field(default=None, pattern="^(draft|standard|final)$")
+    format: Optional[str] = Field(default=None, pattern="^(?i:png|jpe?g|webp)$")
+    quality: Optional[int] = Field(default=None, ge=1, le=100)
+    max_edge: Optional[int] = Field(default=None, ge=256, le=4096)
+    wait: Optional[bool] = None
+
+
+# Image request fields the workers default themselves; forwarded only when set
+_IMAGE_OPTIONS = ("preset", "format", "quality", "max_edge", "wait")
+
+
+def _image_options(request: BaseModel) -> dict:
+    """Optional image worker options the client actually set."""
+    return request.model_dump(
+        include={k for k in _IMAGE_OPTIONS if k in type(request).model_fields},
+        exclude_none=True,
+    )
 
 
 class VisionAnalyzeRequest(BaseModel):
@@ -104,56 +222,63 @@ class VisionAnalyzeRequest(BaseModel):
     max_tokens: int = 512
 
 
-@app.get("/v1/models")
-async def list_models():
+AnalysisTask = Literal["caption", "ocr", "describe", "analyze", "objects", "custom"]
+# Upper bound on tasks per batch, so one request cannot hold the VLM worker indefinitely
+MAX_BATCH_TASKS = 6
+
+
+class VisionAnalyzeBatchRequest(BaseModel):
+    """Several analysis tasks on one image."""
+    image: str  # Base64 encoded image
+    tasks: List[AnalysisTask] = Field(default=["caption"], min_length=1, max_length=MAX_BATCH_TASKS)
+    prompt: Optional[str] = None  # Custom prompt for 'custom' task
+    max_tokens: int = 512
+
+
+@functools.lru_cache(maxsize=1)
+def _models_payload() -> dict:
+    """Model listing, built once (config only changes on restart)."""
+    created = int(time.time())
     return {
         "object": "list",
         "data": [
             {
                 "id": name,
                 "object": "model",
-                "created": int(time.time()),
+                "created": created,
                 "owned_by": "local",
             }
-            for name in config.models.keys()
+            for name in get_config().models.keys()
         ],
     }
 
 
+@app.get("/v1/models")
+async def list_models():
+    return _models_payload()
+
+
 @app.post("/v1/chat/completions")
 async def chat_completions(request: ChatCompletionRequest):
     # 만약 요청된 모델이 없으면 기본값(vlm-fast) 사용
     model_name = request.model
-    if model_name not in config.models:
-        if "gpt" in model_name.lower() or "claude" in model_name.lower():
+    if model_name not in _model_names():
+        lowered = model_name.lower()
+        if any(s in lowered for s in _REDIRECT_SUBSTRINGS):
             model_name = "vlm-fast"  # 기본 모델로 리다이렉트
         else:
             raise HTTPException(
                 status_code=404,
-                detail=f"Model '{model_name}' not found. Available: {list(config.models.keys())}",
+                detail=f"Model '{model_name}' not found. Available: {list(get_config().models.keys())}",
             )
 
-    worker = await supervisor.get_worker(model_name)
-
-    # Check if address is UDS or HTTP
-    if worker.address.startswith("http"):
-        transport = httpx.AsyncHTTPTransport()
-        url = f"{worker.address}/chat"
-    else:
-        transport = httpx.AsyncHTTPTransport(uds=worker.address)
-        url = "http://local/chat"
-
-    async with httpx.AsyncClient(transport=transport) as client:
-        try:
-            resp = await client.post(
-                url,
-                json={"messages": request.messages, "stream": request.stream},
-                timeout=60.0,
-            )
-            return resp.json()
-
-        except Exception as e:
-            raise HTTPException(status_code=500, detail=f"Worker error: {str(e)}")
+    forward = _forward_stream if request.stream else _forward
+    return await forward(
+        model_name,
+        "/chat",
+        {"messages": request.messages, "stream": request.stream},
+        timeout=60.0,
+    )
 
 
 @app.post("/v1/images/generations")
@@ -175,36 +300,24 @@ async def generate_images(request: ImageGenerationRequest):
     ```
     """
     model_alias = "image-gen"
-    if model_alias not in config.models:
+    if model_alias not in _model_names():
         raise HTTPException(status_code=404, detail="Diffusion model not configured")
 
-    worker = await supervisor.get_worker(model_alias)
-
-    if worker.address.startswith("http"):
-        transport = httpx.AsyncHTTPTransport()
-        url = f"{worker.address}/generate"
-    else:
-        transport = httpx.AsyncHTTPTransport(uds=worker.address)
-        url = "http://local/generate"
-
-    async with httpx.AsyncClient(transport=transport) as client:
-        try:
-            resp = await client.post(
-                url,
-                json={
-                    "prompt": request.prompt,
-                    "n": request.n,
-                    "size": request.size,
-                    "model": request.model,
-                    "steps": request.steps,
-                    "seed": request.seed,
-                    "guidance": request.guidance,
-                },
-                timeout=300.0,  # 5 min timeout for image gen
-            )
-            return resp.json()
-        except Exception as e:
-            raise HTTPException(status_code=500, detail=f"Worker error: {str(e)}")
+    return await _forward(
+        model_alias,
+        "/generate",
+        {
+            "prompt": request.prompt,
+            "n": request.n,
+            "size": request.size,
+            "model": request.model,
+            "steps": request.steps,
+            "seed": request.seed,
+            "guidance": request.guidance,
+            **_image_options(request),
+        },
+        timeout=300.0,  # 5 min timeout for image gen
+    )
 
 
 @app.post("/v1/images/edits")
@@ -228,37 +341,53 @@ async def edit_images(request: ImageEditRequest):
     strength: 0.0 = keep original, 1.0 = full regeneration
     """
     model_alias = "image-gen"
-    if model_alias not in config.models:
+    if model_alias not in _model_names():
         raise HTTPException(status_code=404, detail="Diffusion model not configured")
 
-    worker = await supervisor.get_worker(model_alias)
+    return await _forward(
+        model_alias,
+        "/edit",
+        {
+            "prompt": request.prompt,
+            "image": request.image,
+            "strength": request.strength,
+            "size": request.size,
+            "model": request.model,
+            "steps": request.steps,
+            "seed": request.seed,
+            "guidance": request.guidance,
+            **_image_options(request),
+        },
+        timeout=300.0,
+    )
+
+
+@app.get("/v1/images/tasks/{task_id}")
+async def get_image_task(task_id: str):
+    """
+    Result of an image request sent with "wait": false.
 
-    if worker.address.startswith("http"):
-        transport = httpx.AsyncHTTPTransport()
-        url = f"{worker.address}/edit"
-    else:
-        transport = httpx.AsyncHTTPTransport(uds=worker.address)
-        url = "http://local/edit"
+    Returns 202 with the task status while it is queued or running.
+    Polling does not acquire the worker, so it neither counts as a request
+    nor keeps it loaded.
+    """
+    alias = "image-gen"
+    if alias not in _model_names():
+        raise HTTPException(status_code=404, detail="Diffusion model not configured")
 
-    async with httpx.AsyncClient(transport=transport) as client:
-        try:
-            resp = await client.post(
-                url,
-                json={
-                    "prompt": request.prompt,
-                    "image": request.image,
-                    "strength": request.strength,
-                    "size": request.size,
-                    "model": request.model,
-                    "steps": request.steps,
-                    "seed": request.seed,
-                    "guidance": request.guidance,
-                },
-                timeout=300.0,
-            )
-            return resp.json()
-        except Exception as e:
-            raise HTTPException(status_code=500, detail=f"Worker error: {str(e)}")
+    worker = await supervisor.locate_worker(alias)
+    if worker is None:
+        raise HTTPException(status_code=404, detail=f"Unknown task: {task_id}")
+    client = supervisor.get_client(worker.address)
+    try:
+        resp = await client.get("/image", params={"task_id": task_id}, timeout=30.0)
+    except _STALE_WORKER_ERRORS:
+        # Worker gone (and its tasks with it)
+        supervisor.forget_worker(alias)
+        raise HTTPException(status_code=404, detail=f"Unknown task: {task_id}")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Worker error: {str(e)}")
+    return _relay(resp)
 
 
 @app.post("/v1/vision/analyze")
@@ -286,34 +415,59 @@ async def analyze_image(request: VisionAnalyzeRequest):
     - custom: Use provided 'prompt' field
     """
     # Use vlm-fast for quick analysis, vlm-best for comprehensive
-    model_alias = "vlm-best" if request.task in ["analyze", "describe"] else "vlm-fast"
-    if model_alias not in config.models:
-        model_alias = "vlm-fast" if "vlm-fast" in config.models else list(config.models.keys())[0]
-
-    worker = await supervisor.get_worker(model_alias)
+    model_alias = _TASK_TO_MODEL.get(request.task, "vlm-fast")
+    models = _model_names()
+    if model_alias not in models:
+        model_alias = "vlm-fast" if "vlm-fast" in models else next(iter(get_config().models))
+
+    return await _forward(
+        model_alias,
+        "/analyze",
+        {
+            "image": request.image,
+            "task": request.task,
+            "prompt": request.prompt,
+            "max_tokens": request.max_tokens,
+        },
+        timeout=120.0,
+    )
+
+
+@app.post("/v1/vision/analyze_batch")
+async def analyze_image_batch(request: VisionAnalyzeBatchRequest):
+    """
+    Run several analysis tasks on one image.
 
-    if worker.address.startswith("http"):
-        transport = httpx.AsyncHTTPTransport()
-        url = f"{worker.address}/analyze"
-    else:
-        transport = httpx.AsyncHTTPTransport(uds=worker.address)
-        url = "http://local/analyze"
+    The worker decodes and encodes the image once and reuses it for every
+    task, which is cheaper than one /v1/vision/analyze call per task.
 
-    async with httpx.AsyncClient(transport=transport) as client:
-        try:
-            resp = await client.post(
-                url,
-                json={
-                    "image": request.image,
-                    "task": request.task,
-                    "prompt": request.prompt,
-                    "max_tokens": request.max_tokens,
-                },
-                timeout=120.0,
-            )
-            return resp.json()
-        except Exception as e:
-            raise HTTPException(status_code=500, detail=f"Worker error: {str(e)}")
+    Example:
+    ```
+    POST /v1/vision/analyze_batch
+    {
+        "image": "<base64 encoded image>",
+        "tasks": ["caption", "ocr", "objects"]
+    }
+    ```
+    """
+    # One worker serves the whole batch: the best model any task asks for
+    aliases = {_TASK_TO_MODEL.get(t, "vlm-fast") for t in request.tasks}
+    model_alias = "vlm-best" if "vlm-best" in aliases else "vlm-fast"
+    models = _model_names()
+    if model_alias not in models:
+        model_alias = "vlm-fast" if "vlm-fast" in models else next(iter(get_config().models))
+
+    return await _forward(
+        model_alias,
+        "/analyze_batch",
+        {
+            "image": request.image,
+            "tasks": request.tasks,
+            "prompt": request.prompt,
+            "max_tokens": request.max_tokens,
+        },
+        timeout=120.0 * max(1, len(request.tasks)),
+    )
 
 
 @app.get("/v1/vision/tasks")
@@ -365,4 +519,5 @@ async def evict_worker(alias: str):
 if __name__ == "__main__":
     import uvicorn
 
+    config = get_config()
     uvicorn.run(app, host=config.gateway.host, port=config.gateway.port)
@@ -19,12 +19,13 @@ import time
 import sys
 from pathlib import Path
 from dataclasses import dataclass, field
-from typing import Dict, Optional
+from typing import Dict, List, Optional
 from contextlib import asynccontextmanager
 
+import httpx
 import uvicorn
 from fastapi import FastAPI, HTTPException
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 
 # Add project root to path
 PROJECT_ROOT = Path(__file__).parent.parent
@@ -44,6 +45,10 @@ HEALTH_CHECK_INTERVAL = 30  # seconds
 MANAGER_PORT = int(os.getenv("MANAGER_PORT", "8100"))
 # Restart worker after N requests to prevent semaphore leak accumulation
 MAX_REQUESTS_BEFORE_RESTART = int(os.getenv("MAX_REQUESTS", "50"))
+# Seconds to wait for a spawned worker to become healthy
+SPAWN_TIMEOUT_SECONDS = 60
+# How long a successful health probe is trusted for the same port
+HEALTH_CACHE_TTL_SECONDS = 0.5
 
 
 @dataclass
@@ -56,8 +61,9 @@ class WorkerProcess:
     model_type: str
     memory_gb: float
     started_at: float = field(default_factory=time.time)
-    last_used: float = field(default_factory=time.time)
+    last_used: float = field(default_factory=time.time)  # for idle timeout
     request_count: int = 0
+    access_seq: int = 0  # manager-wide access order, for eviction
 
 
 class WorkerManager:
@@ -67,7 +73,31 @@ class WorkerManager:
         self.workers: Dict[str, WorkerProcess] = {}
         self.lock = asyncio.Lock()
         self._monitor_task: Optional[asyncio.Task] = None
+        self._idle_task: Optional[asyncio.Task] = None
+        # Idle deadlines as (deadline, alias), at most one entry per alias; a
+        # touch only moves last_used and the entry is re-armed when it pops
+        self._deadlines: asyncio.PriorityQueue[tuple[float, str]] = asyncio.PriorityQueue()
+        self._deadline_armed: set[str] = set()
         self._running = False
+        # Set by a worker's /ready callback once it is serving
+        self._ready_events: Dict[str, asyncio.Event] = {}
+        # In-flight spawn_worker calls, shared by concurrent callers per alias
+        self._spawn_inflight: Dict[str, asyncio.Future] = {}
+        # Aliases whose process is launched but not yet healthy
+        self._starting: set[str] = set()
+        # Aliases whose process is being terminated; set once it has exited
+        self._stopping: Dict[str, asyncio.Event] = {}
+
+        # port -> monotonic time of the last successful health probe
+        self._health_cache: Dict[int, float] = {}
+        # In-flight health probes, shared by concurrent callers per port
+        self._health_inflight: Dict[int, asyncio.Task] = {}
+
+        # Shared keep-alive client for worker health probes
+        self._health_client = httpx.AsyncClient(
+            limits=httpx.Limits(max_keepalive_connections=32, max_connections=64),
+            timeout=httpx.Timeout(2.0),
+        )
 
         # Port assignments
         self.port_map = {
@@ -77,6 +107,9 @@ class WorkerManager:
         }
         self._next_port = 8010
 
+        # Monotonic access counter; bumped whenever a worker is used
+        self._seq = 0
+
         # Paths
         self.project_root = PROJECT_ROOT
         self.log_dir = self.project_root / "logs"
@@ -91,178 +124,367 @@ class WorkerManager:
         return port
 
     async def _is_worker_healthy(self, port: int, timeout: float = 2.0) -> bool:
-        """Check if worker is responding."""
-        import httpx
+        """
+        Check if worker is responding.
+
+        A success is reused for HEALTH_CACHE_TTL_SECONDS and concurrent probes
+        of the same port share one request.
+        """
+        ok_at = self._health_cache.get(port)
+        if ok_at is not None and time.monotonic() - ok_at < HEALTH_CACHE_TTL_SECONDS:
+            return True
+
+        task = self._health_inflight.get(port)
+        if task is None:
+            task = asyncio.ensure_future(self._probe_health(port, timeout))
+            self._health_inflight[port] = task
+            task.add_done_callback(
+                lambda t: self._health_inflight.pop(port, None)
+                if self._health_inflight.get(port) is t else None
+            )
+        return await asyncio.shield(task)
+
+    async def _probe_health(self, port: int, timeout: float) -> bool:
         try:
-            async with httpx.AsyncClient() as client:
-                resp = await client.get(f"http://localhost:{port}/health", timeout=timeout)
-                return resp.status_code == 200
+            resp = await self._health_client.get(f"http://localhost:{port}/health", timeout=timeout)
+            ok = resp.status_code == 200
         except Exception:
-            return False
+            ok = False
+
+        # Only record the result if the port was not invalidated meanwhile
+        if self._health_inflight.get(port) is asyncio.current_task():
+            if ok:
+                self._health_cache[port] = time.monotonic()
+            else:
+                self._health_cache.pop(port, None)
+        return ok
+
+    async def _pending_tasks(self, port: int) -> int:
+        """Queued or running jobs a worker reports in /health (0 if unknown)."""
+        try:
+            resp = await self._health_client.get(f"http://localhost:{port}/health", timeout=2.0)
+            return int(resp.json().get("pending", 0))
+        except Exception:
+            return 0
+
+    def _invalidate_health(self, port: int):
+        self._health_cache.pop(port, None)
+        self._health_inflight.pop(port, None)
 
     async def spawn_worker(self, alias: str) -> WorkerProcess:
-        """Spawn a new worker process."""
+        """
+        Spawn a new worker process (or return the running one).
+
+        Concurrent calls for the same alias share one in-flight attempt, so a
+        burst triggers a single health check / eviction scan / subprocess.
+        """
+        fut = self._spawn_inflight.get(alias)
+        if fut is None:
+            fut = asyncio.ensure_future(self._spawn_worker(alias))
+            self._spawn_inflight[alias] = fut
+            fut.add_done_callback(lambda _: self._spawn_inflight.pop(alias, None))
+        # Shield so one disconnecting caller does not cancel the spawn for the rest
+        return await asyncio.shield(fut)
+
+    async def _spawn_worker(self, alias: str) -> WorkerProcess:
+        """
+        The lock only covers the checks and Popen; waiting for readiness happens
+        outside it so spawns of other aliases (and stop/touch) are not blocked.
+        """
         async with self.lock:
-            # Already running?
-            if alias in self.workers:
-                worker = self.workers[alias]
-                if worker.process.poll() is None:  # Still alive
-                    if await self._is_worker_healthy(worker.port):
-                        worker.last_used = time.time()
-                        return worker
-                # Dead, clean up
-                del self.workers[alias]
-
-            # Check model exists in config
-            if alias not in config.models:
-                raise ValueError(f"Unknown model: {alias}")
-
-            model_cfg = config.models[alias]
-            memory_gb = get_model_memory_requirement(model_cfg.path, model_cfg.type)
-
-            # Check memory
-            can_load, needed, available = can_load_model(
+            worker, launched = await self._start_worker_locked(alias)
+            if not launched:
+                return worker
+            self._starting.add(alias)
+
+        try:
+            # Wait for worker to be ready
+            print(f"[*] Waiting for {alias} to be ready...")
+            start = time.monotonic()
+            ready = await self._wait_ready(alias, worker.port, start + SPAWN_TIMEOUT_SECONDS)
+            self._ready_events.pop(alias, None)
+            if ready:
+                print(f"[+] {alias} is ready (took {time.monotonic() - start:.1f}s)")
+                return worker
+
+            # Failed to start
+            print(f"[!] {alias} failed to start within timeout")
+            async with self.lock:
+                await self.stop_worker(alias)
+            raise RuntimeError(f"Worker {alias} failed to start")
+        finally:
+            self._starting.discard(alias)
+
+    async def _start_worker_locked(self, alias: str) -> tuple[WorkerProcess, bool]:
+        """
+        Return the running worker for alias, or launch its process (caller holds self.lock).
+
+        Returns (worker, launched). A launched worker is registered in
+        self.workers but not yet known to be healthy.
+        """
+        # Let a previous process for this alias release its port first
+        stopping = self._stopping.get(alias)
+        if stopping is not None:
+            await stopping.wait()
+
+        # Already running?
+        if alias in self.workers:
+            worker = self.workers[alias]
+            if worker.process.poll() is None:  # Still alive
+                if await self._is_worker_healthy(worker.port):
+                    worker.last_used = time.time()
+                    worker.access_seq = self._next_seq()
+                    self._schedule_idle(alias)
+                    return worker, False
+            # Dead, clean up
+            del self.workers[alias]
+            self._invalidate_health(worker.port)
+
+        # Check model exists in config
+        if alias not in config.models:
+            raise ValueError(f"Unknown model: {alias}")
+
+        model_cfg = config.models[alias]
+        memory_gb = get_model_memory_requirement(model_cfg.path, model_cfg.type)
+
+        # Check memory
+        can_load, needed, available = can_load_model(
+            model_cfg.path,
+            model_cfg.type,
+            config.memory.safety_margin_gb
+        )
+
+        if not can_load:
+            # Try to free memory by stopping idle workers
+            await self._evict_for_memory(needed)
+
+            # Check again
+            can_load, _, available = can_load_model(
                 model_cfg.path,
                 model_cfg.type,
                 config.memory.safety_margin_gb
             )
-
             if not can_load:
-                # Try to free memory by stopping idle workers
-                await self._evict_for_memory(needed)
-
-                # Check again
-                can_load, _, available = can_load_model(
-                    model_cfg.path,
-                    model_cfg.type,
-                    config.memory.safety_margin_gb
+                raise MemoryError(
+                    f"Insufficient memory for {alias}: need {needed:.1f}GB, have {available:.1f}GB"
                 )
-                if not can_load:
-                    raise MemoryError(
-                        f"Insufficient memory for {alias}: need {needed:.1f}GB, have {available:.1f}GB"
-                    )
-
-            port = self._get_port(alias)
-            log_file = self.log_dir / f"{alias}.log"
-
-            print(f"[*] Spawning {alias} on port {port} (memory: {memory_gb:.1f}GB)")
-
-            # Start worker process
-            worker_module = model_cfg.type
-            # Map cuda_ prefixed types to cuda worker modules
-            if worker_module.startswith("cuda_"):
-                worker_module = f"cuda_{worker_module[5:]}"
-
-            cmd = [
-                sys.executable, "-m", f"src.workers.{worker_module}_worker",
-                "--alias", alias,
-                "--model_path", model_cfg.path,
-                "--port", str(port),
-            ]
-
-            with open(log_file, "a") as log:
-                log.write(f"\n=== Starting {alias} at {time.ctime()} ===\n")
-
-            # Build environment - pass through CUDA_VISIBLE_DEVICES if set
-            worker_env = {**os.environ, "PYTHONPATH": str(self.project_root)}
-            if hasattr(model_cfg, 'backend') and model_cfg.backend == "cuda":
-                # Propagate GPU-related env vars for CUDA workers
-                for key in ("CUDA_VISIBLE_DEVICES", "GPU_MEMORY_FRACTION",
-                            "TORCH_DTYPE", "LOCAL_FILES_ONLY"):
-                    if key in os.environ:
-                        worker_env[key] = os.environ[key]
 
+        port = self._get_port(alias)
+        log_file = self.log_dir / f"{alias}.log"
+
+        print(f"[*] Spawning {alias} on port {port} (memory: {memory_gb:.1f}GB)")
+
+        # Start worker process
+        worker_module = model_cfg.type
+        # Map cuda_ prefixed types to cuda worker modules
+        if worker_module.startswith("cuda_"):
+            worker_module = f"cuda_{worker_module[5:]}"
+
+        cmd = [
+            sys.executable, "-m", f"src.workers.{worker_module}_worker",
+            "--alias", alias,
+            "--model_path", model_cfg.path,
+            "--port", str(port),
+        ]
+
+        # Build environment - pass through CUDA_VISIBLE_DEVICES if set
+        worker_env = {
+            **os.environ,
+            "PYTHONPATH": str(self.project_root),
+            "WORKER_READY_URL": f"http://127.0.0.1:{MANAGER_PORT}/ready/{alias}",
+        }
+        if hasattr(model_cfg, 'backend') and model_cfg.backend == "cuda":
+            # Propagate GPU-related env vars for CUDA workers
+            for key in ("CUDA_VISIBLE_DEVICES", "GPU_MEMORY_FRACTION",
+                        "TORCH_DTYPE", "LOCAL_FILES_ONLY"):
+                if key in os.environ:
+                    worker_env[key] = os.environ[key]
+
+        self._invalidate_health(port)
+        self._ready_events[alias] = asyncio.Event()
+        # One handle for banner + child output; the child keeps its own dup,
+        # so the parent copy is closed as soon as Popen returns (or fails).
+        with open(log_file, "a") as log:
+            log.write(f"\n=== Starting {alias} at {time.ctime()} ===\n")
+            log.flush()
             process = subprocess.Popen(
                 cmd,
                 cwd=str(self.project_root),
                 env=worker_env,
-                stdout=open(log_file, "a"),
+                stdout=log,
                 stderr=subprocess.STDOUT,
-                preexec_fn=os.setsid,
+                close_fds=True,
+                start_new_session=True,
             )
 
-            worker = WorkerProcess(
-                alias=alias,
-                process=process,
-                port=port,
-                model_path=model_cfg.path,
-                model_type=model_cfg.type,
-                memory_gb=memory_gb,
-            )
-            self.workers[alias] = worker
-
-            # Wait for worker to be ready
-            print(f"[*] Waiting for {alias} to be ready...")
-            for i in range(60):  # 60 seconds timeout
-                if await self._is_worker_healthy(port):
-                    print(f"[+] {alias} is ready (took {i+1}s)")
-                    return worker
-                await asyncio.sleep(1)
+        worker = WorkerProcess(
+            alias=alias,
+            process=process,
+            port=port,
+            model_path=model_cfg.path,
+            model_type=model_cfg.type,
+            memory_gb=memory_gb,
+            access_seq=self._next_seq(),
+        )
+        self.workers[alias] = worker
+        self._schedule_idle(alias)
+        return worker, True
+
+    async def _wait_ready(self, alias: str, port: int, deadline: float) -> bool:
+        """
+        Wait until a worker answers /health.
+
+        Polls with exponential backoff (50ms -> 1s), waking early when the
+        worker calls back on /ready/{alias}.
+        """
+        event = self._ready_events.get(alias) or asyncio.Event()
+        delay = 0.05
+        while time.monotonic() < deadline:
+            if await self._is_worker_healthy(port):
+                return True
+            try:
+                await asyncio.wait_for(event.wait(), timeout=delay)
+            except asyncio.TimeoutError:
+                pass
+            event.clear()
+            delay = min(delay * 1.5, 1.0)
+        return False
 
-            # Failed to start
-            print(f"[!] {alias} failed to start within timeout")
-            self.stop_worker(alias)
-            raise RuntimeError(f"Worker {alias} failed to start")
+    def mark_ready(self, alias: str):
+        """Wake a pending _wait_ready for alias."""
+        event = self._ready_events.get(alias)
+        if event is not None:
+            event.set()
 
     async def _evict_for_memory(self, needed_gb: float):
         """Evict idle workers to free memory."""
-        memory = get_memory_status()
+        memory = get_memory_status(force=True)
         to_free = needed_gb - (memory.available - config.memory.safety_margin_gb)
 
         if to_free <= 0:
             return
 
-        # Sort by last_used (oldest first)
-        workers_by_idle = sorted(
-            self.workers.items(),
-            key=lambda x: x[1].last_used
+        # Free a bit more than strictly needed to avoid evicting again on the next spawn
+        target = to_free * config.memory.eviction_factor
+
+        # Least recently accessed first, larger first on ties;
+        # skip workers that are still starting
+        candidates = sorted(
+            ((a, w) for a, w in self.workers.items() if a not in self._starting),
+            key=lambda x: (x[1].access_seq, -x[1].memory_gb)
         )
 
         freed = 0.0
-        for alias, worker in workers_by_idle:
-            if freed >= to_free:
+        for alias, worker in candidates:
+            if freed >= target:
                 break
             print(f"[*] Evicting {alias} to free {worker.memory_gb:.1f}GB")
-            self.stop_worker(alias)
+            await self.stop_worker(alias)
             freed += worker.memory_gb
             await asyncio.sleep(0.5)  # Let memory be reclaimed
 
-    def stop_worker(self, alias: str) -> bool:
-        """Stop a worker process."""
-        if alias not in self.workers:
+    async def stop_worker(self, alias: str) -> bool:
+        """Stop a worker process (the exit wait runs in a thread, off the event loop)."""
+        worker = self.workers.pop(alias, None)
+        if worker is None:
             return False
 
-        worker = self.workers[alias]
         print(f"[*] Stopping {alias}...")
+        self._invalidate_health(worker.port)
+        stopped = self._stopping[alias] = asyncio.Event()
 
         try:
             os.killpg(os.getpgid(worker.process.pid), signal.SIGTERM)
-            worker.process.wait(timeout=5)
+            await asyncio.to_thread(worker.process.wait, 5)
         except Exception:
             try:
                 os.killpg(os.getpgid(worker.process.pid), signal.SIGKILL)
             except Exception:
                 pass
+        finally:
+            if self._stopping.get(alias) is stopped:
+                del self._stopping[alias]
+            stopped.set()
 
-        del self.workers[alias]
         print(f"[+] {alias} stopped")
         return True
 
-    def touch_worker(self, alias: str):
-        """Update last_used time for a worker."""
+    def touch_worker(self, alias: str, n: int = 1):
+        """Update last_used time for a worker and count n requests against it."""
         if alias in self.workers:
             self.workers[alias].last_used = time.time()
-            self.workers[alias].request_count += 1
+            self.workers[alias].request_count += n
+            self.workers[alias].access_seq = self._next_seq()
+            self._schedule_idle(alias)
+
+    def touch_worker_batch(self, counts: Dict[str, int]):
+        """Apply aggregated touches ({alias: requests}) in one pass."""
+        for alias, n in counts.items():
+            self.touch_worker(alias, n)
+
+    def _next_seq(self) -> int:
+        self._seq += 1
+        return self._seq
+
+    def _schedule_idle(self, alias: str):
+        """Arm an idle deadline for alias unless one is already queued or pending."""
+        if alias in self._deadline_armed:
+            return
+        self._deadline_armed.add(alias)
+        self._deadlines.put_nowait((self.workers[alias].last_used + IDLE_TIMEOUT_SECONDS, alias))
+
+    async def _offload_idle_workers(self):
+        """
+        Background task that stops workers exactly when their idle deadline passes.
+
+        Each alias has one entry, holding last_used + IDLE_TIMEOUT_SECONDS as of
+        when it was pushed. Touches only move last_used forward, so on expiry an
+        entry whose worker was used since is re-armed at its real deadline.
+        The queue stays bounded by the number of workers, not requests.
+        """
+        while self._running:
+            try:
+                deadline, alias = await self._deadlines.get()
+                delay = deadline - time.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+
+                worker = self.workers.get(alias)
+                if worker is None:
+                    self._deadline_armed.discard(alias)
+                    continue
+
+                deadline = worker.last_used + IDLE_TIMEOUT_SECONDS
+                if deadline > time.time():
+                    self._deadlines.put_nowait((deadline, alias))
+                    continue
+
+                if await self._pending_tasks(worker.port):
+                    # Polled wait=false jobs do not touch; re-check shortly
+                    self._deadlines.put_nowait(
+                        (time.time() + min(HEALTH_CHECK_INTERVAL, IDLE_TIMEOUT_SECONDS), alias)
+                    )
+                    continue
+
+                self._deadline_armed.discard(alias)
+
+                idle_time = time.time() - worker.last_used
+                print(f"[*] {alias} idle for {idle_time:.0f}s, offloading...")
+                await self.stop_worker(alias)
+
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"[!] Idle offload error: {e}")
 
     async def _monitor_idle_workers(self):
-        """Background task to offload idle workers."""
+        """Background task to reap dead workers and recycle busy ones (idle offload is deadline-driven)."""
         print(f"[*] Idle monitor started (timeout: {IDLE_TIMEOUT_SECONDS}s, max_requests: {MAX_REQUESTS_BEFORE_RESTART})")
 
         while self._running:
             try:
                 await asyncio.sleep(HEALTH_CHECK_INTERVAL)
 
-                now = time.time()
                 to_stop = []
 
                 for alias, worker in list(self.workers.items()):
@@ -272,20 +494,15 @@ class WorkerManager:
                         to_stop.append(alias)
                         continue
 
-                    # Check idle timeout
-                    idle_time = now - worker.last_used
-                    if idle_time > IDLE_TIMEOUT_SECONDS:
-                        print(f"[*] {alias} idle for {idle_time:.0f}s, offloading...")
-                        to_stop.append(alias)
-                        continue
-
                     # Check request count (prevent semaphore leak accumulation)
                     if worker.request_count >= MAX_REQUESTS_BEFORE_RESTART:
+                        if await self._pending_tasks(worker.port):
+                            continue  # recycle once its queued jobs are done
                         print(f"[*] {alias} reached {worker.request_count} requests, recycling to prevent resource leaks...")
                         to_stop.append(alias)
 
-                for alias in to_stop:
-                    self.stop_worker(alias)
+                if to_stop:
+                    await asyncio.gather(*(self.stop_worker(a) for a in to_stop))
 
             except Exception as e:
                 print(f"[!] Monitor error: {e}")
@@ -294,16 +511,19 @@ class WorkerManager:
         """Start the idle monitor background task."""
         self._running = True
         self._monitor_task = asyncio.create_task(self._monitor_idle_workers())
+        self._idle_task = asyncio.create_task(self._offload_idle_workers())
 
     def stop_monitor(self):
         """Stop the idle monitor."""
         self._running = False
         if self._monitor_task:
             self._monitor_task.cancel()
+        if self._idle_task:
+            self._idle_task.cancel()
 
     def get_status(self) -> dict:
         """Get current status."""
-        memory = get_memory_status()
+        memory = get_memory_status(force=True)
 
         return {
             "workers": {
@@ -335,11 +555,14 @@ class WorkerManager:
             }
         }
 
-    def shutdown(self):
-        """Stop all workers."""
+    async def shutdown(self):
+        """Stop all workers concurrently."""
         print("[*] Shutting down all workers...")
-        for alias in list(self.workers.keys()):
-            self.stop_worker(alias)
+        await asyncio.gather(*(self.stop_worker(a) for a in list(self.workers)))
+
+    async def aclose(self):
+        """Release the shared HTTP client (on manager exit)."""
+        await self._health_client.aclose()
 
 
 # Global manager instance
@@ -353,12 +576,22 @@ async def lifespan(app: FastAPI):
     manager.start_monitor()
     yield
     manager.stop_monitor()
-    manager.shutdown()
+    await manager.shutdown()
+    await manager.aclose()
 
 
 app = FastAPI(title="Vision Worker Manager", lifespan=lifespan)
 
 
+class TouchEvent(BaseModel):
+    alias: str
+    n: int = Field(default=1, ge=1)
+
+
+class TouchBatchRequest(BaseModel):
+    events: List[TouchEvent]
+
+
 class SpawnResponse(BaseModel):
     alias: str
     port: int
@@ -396,10 +629,25 @@ async def spawn(alias: str) -> SpawnResponse:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.post("/acquire/{alias}")
+async def acquire(alias: str) -> SpawnResponse:
+    """Spawn a worker (or return existing one) and reset its idle timer."""
+    response = await spawn(alias)
+    manager.touch_worker(alias)
+    return response
+
+
+@app.post("/ready/{alias}")
+async def ready(alias: str):
+    """Readiness callback from a worker that finished loading."""
+    manager.mark_ready(alias)
+    return {"status": "ok"}
+
+
 @app.post("/stop/{alias}")
 async def stop(alias: str):
     """Stop a worker."""
-    if manager.stop_worker(alias):
+    if await manager.stop_worker(alias):
         return {"status": "stopped", "alias": alias}
     raise HTTPException(status_code=404, detail=f"Worker {alias} not found")
 
@@ -411,11 +659,21 @@ async def touch(alias: str):
     return {"status": "ok"}
 
 
+@app.post("/touch-batch")
+async def touch_batch(request: TouchBatchRequest):
+    """Apply many touches at once (request counts aggregated by the gateway)."""
+    counts: Dict[str, int] = {}
+    for event in request.events:
+        counts[event.alias] = counts.get(event.alias, 0) + event.n
+    manager.touch_worker_batch(counts)
+    return {"status": "ok", "aliases": len(counts)}
+
+
 @app.post("/stop-all")
 async def stop_all():
     """Stop all workers."""
     count = len(manager.workers)
-    manager.shutdown()
+    await manager.shutdown()
     return {"status": "stopped", "count": count}
 
 
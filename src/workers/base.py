@@ -1,36 +1,434 @@
 import argparse
+import asyncio
+import base64
+import binascii
+import hashlib
+import io
+import json
+import logging
+import logging.handlers
+import queue
+import re
+import time
+import urllib.request
+import uuid
 import uvicorn
 import os
+import atexit
 import signal
-from fastapi import FastAPI
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from typing import Any, Callable, Optional
+from fastapi import FastAPI, HTTPException
+from fastapi.responses import JSONResponse
+from PIL import Image
+
+
+# Set by the Worker Manager; the worker POSTs here once it is serving
+WORKER_READY_URL = os.getenv("WORKER_READY_URL")
+
+
+_log_listener: Optional[logging.handlers.QueueListener] = None
+
+
+class _DeferredQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that enqueues records unformatted.
+
+    The stock prepare() formats the message and traceback in the emitting
+    thread. Within one process the record (args, exc_info) can be handed to
+    the listener as-is, so all formatting happens there.
+    """
+
+    def prepare(self, record):
+        return record
+
+
+def _configure_logging():
+    """Route worker logging through a queue so message/traceback formatting
+    and stderr writes happen on a listener thread instead of the event loop."""
+    global _log_listener
+    if _log_listener is not None:
+        return
+    stream = logging.StreamHandler()
+    stream.setFormatter(logging.Formatter("[!] %(message)s"))
+    log_queue = queue.SimpleQueue()
+    _log_listener = logging.handlers.QueueListener(log_queue, stream)
+    _log_listener.start()
+    atexit.register(_log_listener.stop)
+    root = logging.getLogger()
+    root.addHandler(_DeferredQueueHandler(log_queue))
+    root.setLevel(logging.WARNING)
 
 
 class BaseWorker:
     def __init__(
         self, alias: str, model_path: str, socket_path: str = None, port: int = None
     ):
+        _configure_logging()
         self.alias = alias
         self.model_path = model_path
         self.socket_path = socket_path
         self.port = port
-        self.app = FastAPI(title=f"Worker {alias}")
+        self.app = FastAPI(title=f"Worker {alias}", lifespan=self._lifespan)
+        self._server = None
         self._setup_routes()
 
     def _setup_routes(self):
         @self.app.get("/health")
         async def health():
-            return {"status": "ok"}
+            # pending lets the manager avoid recycling a worker mid-job
+            tasks = getattr(self, "_task_queue", None)
+            return {"status": "ok", "pending": tasks.pending() if tasks else 0}
+
+    async def _submit(
+        self, tasks: "TaskQueue", fn: Callable[[], Any], steps: int, wait: bool = True,
+        key: Optional[str] = None,
+    ):
+        """Queue a blocking job; return its result, or a task handle if not waiting."""
+        # Only polled (wait=false) results are kept for /image
+        state = tasks.submit(fn, steps, key, keep=not wait)
+        if not wait:
+            return {
+                "task_id": state.task_id,
+                "status": state.status,
+                "expected_time_seconds": tasks.expected_seconds(state),
+            }
+        # Shield so a disconnecting client does not cancel the queued job
+        return await asyncio.shield(state.future)
+
+    def _setup_task_routes(self, tasks: "TaskQueue"):
+        """Add GET /status and GET /image for jobs submitted with "wait": false."""
+        self._task_queue = tasks
+
+        @self.app.get("/status")
+        async def task_status(task_id: str):
+            info = tasks.status(task_id)
+            if info is None:
+                raise HTTPException(status_code=404, detail=f"Unknown task: {task_id}")
+            return info
+
+        @self.app.get("/image")
+        async def task_image(task_id: str):
+            state = tasks.tasks.get(task_id)
+            if state is None:
+                raise HTTPException(status_code=404, detail=f"Unknown task: {task_id}")
+            if state.status not in ("done", "error"):
+                return JSONResponse(tasks.status(task_id), status_code=202)
+            # Delivered once, then released
+            tasks.tasks.pop(task_id, None)
+            if state.status == "error":
+                return {"error": state.error}
+            return state.result
+
+    @asynccontextmanager
+    async def _lifespan(self, app: FastAPI):
+        task = asyncio.create_task(self._notify_ready()) if WORKER_READY_URL else None
+        yield
+        if task is not None:
+            task.cancel()
+
+    async def _notify_ready(self):
+        """Tell the Worker Manager we are serving, so it can stop polling."""
+        while self._server is not None and not self._server.started:
+            await asyncio.sleep(0.01)
+        try:
+            await asyncio.to_thread(_post_ready, WORKER_READY_URL)
+        except Exception:
+            pass  # Manager falls back to polling /health
 
     def run(self):
         print(f"[*] Worker {self.alias} starting...")
         if self.socket_path:
             if os.path.exists(self.socket_path):
                 os.remove(self.socket_path)
-            uvicorn.run(self.app, uds=self.socket_path, log_level="error")
+            config = uvicorn.Config(self.app, uds=self.socket_path, log_level="error")
         elif self.port:
-            uvicorn.run(self.app, host="0.0.0.0", port=self.port, log_level="error")
+            config = uvicorn.Config(self.app, host="0.0.0.0", port=self.port, log_level="error")
         else:
             raise ValueError("Either socket or port must be specified.")
+        self._server = uvicorn.Server(config)
+        self._server.run()
+
+
+@dataclass(slots=True)
+class TaskState:
+    """A queued generation job."""
+    task_id: str
+    steps: int
+    status: str = "queued"  # queued | running | done | error
+    created: float = field(default_factory=time.time)
+    started: Optional[float] = None
+    finished: Optional[float] = None
+    result: Any = None
+    error: Optional[str] = None
+    future: Optional[asyncio.Future] = None
+    key: Optional[str] = None
+    keep: bool = False  # result retained for /image (wait=false submitters)
+
+
+class TaskQueue:
+    """
+    FIFO of blocking generation jobs run one at a time in a thread.
+
+    The event loop stays free to accept requests and answer /status while the
+    GPU is busy. Per-step time is tracked as an EMA for ETA estimates.
+    after_job, if given, runs in the same thread after every job.
+    """
+
+    MAX_FINISHED = 64
+    # Undelivered wait=false results are dropped after this long
+    RESULT_TTL_SECONDS = 600
+
+    def __init__(self, default_step_seconds: float = 1.0, after_job: Optional[Callable[[], Any]] = None):
+        self.tasks: "OrderedDict[str, TaskState]" = OrderedDict()
+        self.avg_step_time = default_step_seconds
+        self._after_job = after_job
+        # Dedup key -> queued/running task, so identical requests share one job
+        self._inflight: dict[str, TaskState] = {}
+        self._queue: Optional[asyncio.Queue] = None
+        self._consumer: Optional[asyncio.Task] = None
+
+    def submit(
+        self, fn: Callable[[], Any], steps: int, key: Optional[str] = None, keep: bool = False
+    ) -> TaskState:
+        """
+        Queue fn (run via asyncio.to_thread) and return its task state.
+
+        If key matches a job that is still queued or running, that job's state
+        is returned instead and fn is not queued. With keep, the finished
+        result stays available (see status()/tasks) until delivered or expired;
+        otherwise only the submitters awaiting the future receive it.
+        """
+        self._prune()
+        if key is not None and key in self._inflight:
+            state = self._inflight[key]
+            state.keep = state.keep or keep
+            return state
+
+        if self._queue is None:
+            self._queue = asyncio.Queue()
+        if self._consumer is None or self._consumer.done():
+            self._consumer = asyncio.create_task(self._consume())
+
+        state = TaskState(task_id=uuid.uuid4().hex[:8], steps=max(steps, 1), key=key, keep=keep)
+        state.future = asyncio.get_running_loop().create_future()
+        self.tasks[state.task_id] = state
+        if key is not None:
+            self._inflight[key] = state
+        self._queue.put_nowait((state, fn))
+        return state
+
+    def pending(self) -> int:
+        """Number of queued or running jobs."""
+        return sum(1 for t in self.tasks.values() if t.status in ("queued", "running"))
+
+    def expected_seconds(self, state: TaskState) -> float:
+        """Estimated seconds until state finishes (running job + jobs ahead + itself)."""
+        pending = 0
+        for other in self.tasks.values():
+            if other.status in ("queued", "running"):
+                pending += other.steps
+            if other is state:
+                break
+        return round(self.avg_step_time * pending, 2)
+
+    async def _consume(self):
+        while True:
+            state, fn = await self._queue.get()
+            state.status = "running"
+            state.started = time.time()
+            try:
+                state.result = await asyncio.to_thread(self._run, fn)
+                state.status = "done"
+                step_time = (time.time() - state.started) / state.steps
+                self.avg_step_time = 0.8 * self.avg_step_time + 0.2 * step_time
+                state.future.set_result(state.result)
+            except Exception as e:
+                state.status = "error"
+                state.error = str(e)
+                state.future.set_exception(e)
+                # Nobody may ever await it (polling clients)
+                state.future.exception()
+            finally:
+                state.finished = time.time()
+                if state.key is not None:
+                    self._inflight.pop(state.key, None)
+                if not state.keep:
+                    # Awaiting callers already hold the result via the future
+                    self.tasks.pop(state.task_id, None)
+                self._prune()
+
+    def _run(self, fn: Callable[[], Any]) -> Any:
+        try:
+            return fn()
+        finally:
+            if self._after_job is not None:
+                try:
+                    self._after_job()
+                except Exception as e:
+                    print(f"[!] after_job error: {e}")
+
+    def _prune(self):
+        """Drop results older than RESULT_TTL_SECONDS, then keep at most MAX_FINISHED."""
+        expiry = time.time() - self.RESULT_TTL_SECONDS
+        finished = []
+        for tid, t in list(self.tasks.items()):
+            if t.status not in ("done", "error"):
+                continue
+            if t.finished < expiry:
+                del self.tasks[tid]
+            else:
+                finished.append(tid)
+        for tid in finished[:-self.MAX_FINISHED]:
+            del self.tasks[tid]
+
+    def status(self, task_id: str) -> Optional[dict]:
+        state = self.tasks.get(task_id)
+        if state is None:
+            return None
+        info = {"task_id": task_id, "status": state.status}
+        if state.status in ("queued", "running"):
+            info["expected_time_seconds"] = self.expected_seconds(state)
+        if state.error:
+            info["error"] = state.error
+        return info
+
+
+# "data:<mime>[;params],"; only the head of the string is examined
+_DATA_URL_RE = re.compile(rb"data:[^,]{0,128},")
+
+
+def decode_base64_data(data: str | bytes) -> bytes:
+    """
+    Decode base64 text, with or without a data-URL header.
+
+    The header check is anchored at the start and the payload is decoded
+    through a memoryview, so the (multi-MB) string is not scanned or copied
+    before decoding.
+    """
+    raw = data.encode("ascii") if isinstance(data, str) else data
+    m = _DATA_URL_RE.match(raw)
+    if m is None:
+        return binascii.a2b_base64(raw)
+    with memoryview(raw) as view, view[m.end():] as payload:
+        return binascii.a2b_base64(payload)
+
+
+class BufferPool:
+    """
+    Reusable BytesIO buffers for image encoding (thread-safe).
+
+    Buffers are rewound, not truncated, so they keep their capacity; only the
+    bytes written this time are encoded.
+    """
+
+    def __init__(self, maxsize: int = 8):
+        self._pool: queue.LifoQueue = queue.LifoQueue(maxsize=maxsize)
+
+    def encode_b64(self, write: Callable[[io.BytesIO], Any]) -> str:
+        """Run write(buffer) and return what it wrote as base64 text."""
+        try:
+            buf = self._pool.get_nowait()
+        except queue.Empty:
+            buf = io.BytesIO()
+        try:
+            buf.seek(0)
+            write(buf)
+            n = buf.tell()
+            with buf.getbuffer() as view, view[:n] as data:
+                return base64.b64encode(data).decode("ascii")
+        finally:
+            try:
+                self._pool.put_nowait(buf)
+            except queue.Full:
+                pass
+
+
+    def encode_image(self, image: Image.Image, fmt: str = "JPEG", quality: int = 90) -> str:
+        """Encode a PIL image as base64 text (JPEG/WEBP lossy, PNG lossless)."""
+        fmt = fmt.upper()
+        if fmt == "JPG":
+            fmt = "JPEG"
+        save_kwargs = {"quality": quality, "optimize": False} if fmt in ("JPEG", "WEBP") else {}
+        if fmt == "JPEG" and image.mode != "RGB":
+            image = image.convert("RGB")
+        return self.encode_b64(lambda buf: image.save(buf, format=fmt, **save_kwargs))
+
+
+def decode_base64_image(data: str) -> Image.Image:
+    """Open a base64 (or data URL) image."""
+    return Image.open(io.BytesIO(decode_base64_data(data)))
+
+
+def request_key(params: dict) -> str:
+    """Stable hash of generation parameters, for deduplicating identical requests."""
+    blob = json.dumps(params, sort_keys=True, default=str).encode()
+    return hashlib.blake2b(blob, digest_size=16).hexdigest()
+
+
+def release_mlx_cache():
+    """Wait for pending MLX work, then return cached Metal buffers (no-op without MLX)."""
+    try:
+        import mlx.core as mx
+    except ImportError:
+        return
+    try:
+        synchronize = getattr(mx, "synchronize", None)
+        if synchronize is not None:
+            synchronize()
+        clear_cache = getattr(mx, "clear_cache", None) or mx.metal.clear_cache
+        clear_cache()
+    except Exception:
+        pass
+
+
+# Release MLX's Metal buffer cache after every FLUX job (lower resident memory on shared Macs)
+FLUX_AGGRESSIVE_FREE = os.getenv("FLUX_AGGRESSIVE_FREE", "0") == "1"
+# Run a tiny generation after each FLUX load so Metal kernels compile before the first request
+FLUX_WARMUP = os.getenv("FLUX_WARMUP", "0") == "1"
+# FLUX step counts per speed/quality preset: draft halves latency for prompt exploration
+STEP_PRESETS = {
+    "schnell": {"draft": 2, "standard": 4, "final": 6},
+    "dev": {"draft": 10, "standard": 20, "final": 30},
+}
+
+# FLUX-friendly (width, height) buckets: multiples of 64 between 512 and 1280
+# with 512*512 <= area <= 1280*1024. Snapping to these keeps the set of shapes
+# small, so compiled kernels are reused across requests.
+FLUX_BUCKETS = tuple(
+    (w, h)
+    for w in range(512, 1281, 64)
+    for h in range(512, 1281, 64)
+    if 512 * 512 <= w * h <= 1280 * 1024
+)
+
+
+def nearest_bucket(width: int, height: int) -> tuple[int, int]:
+    """Bucket closest in aspect ratio to width x height, then closest in area."""
+    ar = width / max(height, 1)
+    area = width * height
+    return min(
+        FLUX_BUCKETS,
+        key=lambda b: (round(abs(b[0] / b[1] - ar), 3), abs(b[0] * b[1] - area)),
+    )
+
+
+def cap_edge(image: Image.Image, max_edge: int = 1024) -> Image.Image:
+    """Downscale (Lanczos) so the longest edge is at most max_edge."""
+    width, height = image.size
+    scale = min(1.0, max_edge / max(width, height))
+    if scale >= 1.0:
+        return image
+    # max(1, ...) so extreme aspect ratios never round an edge down to 0
+    size = (max(1, int(width * scale)), max(1, int(height * scale)))
+    return image.resize(size, Image.Resampling.LANCZOS)
+
+
+def _post_ready(url: str):
+    request = urllib.request.Request(url, data=b"", method="POST")
+    with urllib.request.urlopen(request, timeout=2):
+        pass
 
 
 def get_base_args():
@@ -8,11 +8,19 @@ Supports:
 
 import sys
 import time
-import base64
-import io
+import inspect
+import re
+import logging
 import os
+from fastapi import HTTPException
 from PIL import Image
-from src.workers.base import BaseWorker, get_base_args
+from src.workers.base import (
+    FLUX_AGGRESSIVE_FREE, FLUX_WARMUP, STEP_PRESETS, BaseWorker, BufferPool, TaskQueue,
+    cap_edge, decode_base64_image, get_base_args, nearest_bucket, release_mlx_cache,
+    request_key,
+)
+
+logger = logging.getLogger(__name__)
 
 # Import mflux (0.15+ API)
 try:
@@ -28,6 +36,38 @@ except ImportError as e:
     IMPORT_ERROR = str(e)
 
 
+# Named low-bit formats recognised in model paths, with their nominal bit width
+# (used instead when the installed mflux only takes integer bits)
+_NAMED_QUANTS = {"nf4": 4, "jang_2s": 2}
+_BITS_RE = re.compile(r"(\d+)-?bit")
+
+
+def parse_quantization(model_path: str):
+    """Quantization from a model path: a named format ("nf4", "jang_2s"), bits, or None."""
+    path = model_path.lower()
+    for name in _NAMED_QUANTS:
+        if name in path:
+            return name
+    m = _BITS_RE.search(path)
+    return int(m.group(1)) if m else None
+
+
+def _accepts_named_quant() -> bool:
+    """Whether the installed Flux1 takes string quantize values (per its annotation)."""
+    try:
+        param = inspect.signature(Flux1).parameters.get("quantize")
+    except (TypeError, ValueError):
+        return False
+    if param is None or param.annotation is inspect.Parameter.empty:
+        return False
+    annotation = param.annotation
+    return "str" in (annotation if isinstance(annotation, str) else repr(annotation))
+
+
+def _quant_label(quantize) -> str:
+    return f"{quantize}-bit" if isinstance(quantize, int) else quantize
+
+
 class DiffusionWorker(BaseWorker):
     """
     FLUX-based image generation worker.
@@ -37,9 +77,15 @@ class DiffusionWorker(BaseWorker):
     """
 
     def __init__(self, alias, model_path, socket_path=None, port=None):
+        # needed by _setup_routes
+        self.tasks = TaskQueue(after_job=release_mlx_cache if FLUX_AGGRESSIVE_FREE else None)
+        self._buffers = BufferPool()
         super().__init__(alias, model_path, socket_path, port)
         self.flux = None
         self._model_type = None
+        self._quantize = None
+        # True when generate_image accepts a PIL init_image (no temp file needed)
+        self._accepts_init_image = False
         self._load_model()
 
     def _load_model(self):
@@ -52,42 +98,63 @@ class DiffusionWorker(BaseWorker):
 
             # Determine model type and quantization from config
             model_type = "schnell" if "schnell" in self.model_path.lower() else "dev"
-            num_bits = 4 if "4bit" in self.model_path.lower() else None
+            quantize = parse_quantization(self.model_path)
+            if isinstance(quantize, str) and not _accepts_named_quant():
+                bits = _NAMED_QUANTS[quantize]
+                print(f"[!] mflux only accepts integer quantization; loading {quantize} as {bits}-bit")
+                quantize = bits
 
             # Create model config for the base model type
             model_config = ModelConfig.from_name(model_name=model_type)
 
             # Initialize Flux1 with quantization
             # mflux will automatically download and quantize the model
-            print(f"[*] Initializing FLUX.1-{model_type} with {num_bits or 'no'}-bit quantization...")
-            self.flux = Flux1(
-                model_config=model_config,
-                quantize=num_bits,
-            )
+            print(f"[*] Initializing FLUX.1-{model_type} with {_quant_label(quantize) or 'no'} quantization...")
+            self.flux = Flux1(model_config=model_config, quantize=quantize)
 
             self._model_type = model_type
-            print(f"[+] FLUX.1-{model_type} ({num_bits or 'full'}-bit) loaded on Apple Silicon GPU")
+            self._quantize = quantize
+            params = inspect.signature(self.flux.generate_image).parameters
+            self._accepts_init_image = "init_image" in params
+            print(f"[+] FLUX.1-{model_type} ({_quant_label(quantize) or 'full precision'}) loaded on Apple Silicon GPU")
+
+            if FLUX_WARMUP:
+                try:
+                    start = time.time()
+                    self._generate(0, "warmup", 256, 256, 1, 0.0)
+                    print(f"[+] FLUX warmup complete ({time.time() - start:.1f}s)")
+                except Exception as e:
+                    print(f"[!] FLUX warmup failed: {e}")
 
         except Exception as e:
-            print(f"[!] Model loading error: {e}")
-            import traceback
-            traceback.print_exc()
-
-    def _base64_to_image(self, b64_string: str) -> Image.Image:
-        """Convert base64 string to PIL Image."""
-        if "," in b64_string:
-            b64_string = b64_string.split(",", 1)[1]
-        image_data = base64.b64decode(b64_string)
-        return Image.open(io.BytesIO(image_data))
-
-    def _image_to_base64(self, image: Image.Image) -> str:
-        """Convert PIL Image to base64 string."""
-        buffered = io.BytesIO()
-        image.save(buffered, format="PNG")
-        return base64.b64encode(buffered.getvalue()).decode()
+            logger.exception("Model loading error: %s", e)
+
+    def _resolve_steps(self, request: dict) -> int:
+        """Explicit steps win; otherwise the preset for this model, defaulting to "standard"."""
+        presets = STEP_PRESETS.get(self._model_type or "schnell", STEP_PRESETS["schnell"])
+        preset = request.get("preset") or "standard"
+        if not isinstance(preset, str) or preset not in presets:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Unknown preset: {preset!r} (expected one of {', '.join(presets)})",
+            )
+        return request.get("steps") or presets[preset]
+
+    def _generate(self, seed, prompt, width, height, steps, guidance, **image_kwargs):
+        """Run mflux generate_image with the shared arguments."""
+        return self.flux.generate_image(
+            seed=seed,
+            prompt=prompt,
+            width=width,
+            height=height,
+            num_inference_steps=steps,
+            guidance=guidance,
+            **image_kwargs,
+        )
 
     def _setup_routes(self):
         super()._setup_routes()
+        self._setup_task_routes(self.tasks)
 
         @self.app.post("/generate")
         async def generate(request: dict):
@@ -101,12 +168,22 @@ class DiffusionWorker(BaseWorker):
                 "steps": 4,
                 "seed": 42
             }
+
+            Instead of "steps", "preset" (draft|standard|final) picks a step
+            count for the loaded model.
+
+            With "wait": false, returns a task_id to poll via /status and /image.
             """
             prompt = request.get("prompt", "")
             size = request.get("size", "1024x1024")
-            steps = request.get("steps") or 4  # default 4 steps for schnell
-            seed = request.get("seed", int(time.time()))
+            steps = self._resolve_steps(request)
+            seed = request.get("seed")
+            explicit_seed = seed is not None
+            if seed is None:
+                seed = int(time.time())
             guidance = request.get("guidance", 3.5)
+            fmt = request.get("format", "JPEG")
+            quality = request.get("quality", 90)
 
             # Parse size
             try:
@@ -118,10 +195,10 @@ class DiffusionWorker(BaseWorker):
                 print("[!] FLUX model not loaded, returning mock image")
                 return self._mock_gen(prompt)
 
-            print(f"[*] Generating image: {prompt[:50]}... ({width}x{height}, steps={steps})")
-            start_time = time.time()
+            def run():
+                print(f"[*] Generating image: {prompt[:50]}... ({width}x{height}, steps={steps})")
+                start_time = time.time()
 
-            try:
                 # Generate image using mflux API
                 generated = self.flux.generate_image(
                     seed=seed,
@@ -134,7 +211,7 @@ class DiffusionWorker(BaseWorker):
 
                 # Get PIL image from GeneratedImage object
                 img = generated.image if hasattr(generated, 'image') else generated
-                img_str = self._image_to_base64(img)
+                img_str = self._buffers.encode_image(img, fmt, quality)
 
                 latency = time.time() - start_time
                 print(f"[+] Generation complete ({latency:.2f}s)")
@@ -145,12 +222,30 @@ class DiffusionWorker(BaseWorker):
                     "usage": {"latency": latency, "seed": seed},
                 }
 
+            try:
+                # Identical concurrent requests share one generation, but only
+                # with an explicit seed: unseeded requests must stay distinct
+                key = request_key({
+                    "prompt": prompt, "width": width, "height": height, "steps": steps,
+                    "seed": seed, "guidance": guidance, "format": fmt, "quality": quality,
+                }) if explicit_seed else None
+                return await self._submit(self.tasks, run, steps, request.get("wait", True), key)
             except Exception as e:
-                print(f"[!] Generation error: {e}")
-                import traceback
-                traceback.print_exc()
+                logger.exception("Generation error: %s", e)
                 return {"error": str(e)}
 
+        @self.app.get("/models")
+        async def list_models():
+            """Loaded FLUX variant and the quantization actually in effect."""
+            return {
+                "models": [{
+                    "id": self._model_type,
+                    "path": self.model_path,
+                    "quantize": self._quantize,
+                    "loaded": self.flux is not None,
+                }],
+            }
+
         @self.app.post("/edit")
         async def edit(request: dict):
             """
@@ -163,13 +258,20 @@ class DiffusionWorker(BaseWorker):
                 "strength": 0.7,
                 "steps": 4
             }
+
+            With "wait": false, returns a task_id to poll via /status and /image.
             """
             prompt = request.get("prompt", "")
             image_b64 = request.get("image", "")
             strength = request.get("strength", 0.7)
-            steps = request.get("steps") or 4  # default 4 steps for schnell
-            seed = request.get("seed", int(time.time()))
+            steps = self._resolve_steps(request)
+            seed = request.get("seed")
+            if seed is None:
+                seed = int(time.time())
             guidance = request.get("guidance", 3.5)
+            fmt = request.get("format", "JPEG")
+            quality = request.get("quality", 90)
+            max_edge = request.get("max_edge", 1024)
 
             if self.flux is None:
                 print("[!] FLUX model not loaded, returning mock image")
@@ -178,42 +280,43 @@ class DiffusionWorker(BaseWorker):
             if not image_b64:
                 return {"error": "image field is required for img2img"}
 
-            print(f"[*] Editing image: {prompt[:50]}... (strength={strength})")
-            start_time = time.time()
-
-            try:
-                # Decode and save input image temporarily
-                input_image = self._base64_to_image(image_b64)
-                width, height = input_image.size
-
-                # Ensure dimensions are multiples of 16
-                width = (width // 16) * 16
-                height = (height // 16) * 16
-
-                # Save temp image for mflux
-                import tempfile
-                with tempfile.NamedTemporaryFile(suffix=".png", delete=False) as tmp:
-                    input_image.save(tmp, format="PNG")
-                    tmp_path = tmp.name
+            def run():
+                start_time = time.time()
+
+                input_image = decode_base64_image(image_b64)
+                original_size = input_image.size
+                input_image = cap_edge(input_image, max_edge)
+                # Snap to the nearest aspect-ratio bucket (multiples of 64)
+                width, height = nearest_bucket(*input_image.size)
+                print(
+                    f"[*] Editing image: {prompt[:50]}... (strength={strength}, "
+                    f"{original_size[0]}x{original_size[1]} -> {width}x{height})"
+                )
 
-                try:
-                    # Generate with image input
-                    generated = self.flux.generate_image(
-                        seed=seed,
-                        prompt=prompt,
-                        width=width,
-                        height=height,
-                        num_inference_steps=steps,
-                        guidance=guidance,
-                        image_path=tmp_path,
-                        image_strength=strength,
+                if self._accepts_init_image:
+                    # Hand the decoded image over in memory
+                    generated = self._generate(
+                        seed, prompt, width, height, steps, guidance,
+                        init_image=input_image,
+                        init_image_strength=strength,
                     )
+                else:
+                    # This mflux only takes a path; write it uncompressed
+                    import tempfile
+                    with tempfile.NamedTemporaryFile(suffix=".png", delete=False) as tmp:
+                        input_image.save(tmp, format="PNG", compress_level=0)
+                        tmp_path = tmp.name
+                    try:
+                        generated = self._generate(
+                            seed, prompt, width, height, steps, guidance,
+                            image_path=tmp_path,
+                            image_strength=strength,
+                        )
+                    finally:
+                        os.unlink(tmp_path)
 
-                    img = generated.image if hasattr(generated, 'image') else generated
-                    img_str = self._image_to_base64(img)
-                finally:
-                    # Clean up temp file
-                    os.unlink(tmp_path)
+                img = generated.image if hasattr(generated, 'image') else generated
+                img_str = self._buffers.encode_image(img, fmt, quality)
 
                 latency = time.time() - start_time
                 print(f"[+] Edit complete ({latency:.2f}s)")
@@ -224,18 +327,16 @@ class DiffusionWorker(BaseWorker):
                     "usage": {"latency": latency, "strength": strength, "seed": seed},
                 }
 
+            try:
+                return await self._submit(self.tasks, run, steps, request.get("wait", True))
             except Exception as e:
-                print(f"[!] Edit error: {e}")
-                import traceback
-                traceback.print_exc()
+                logger.exception("Edit error: %s", e)
                 return {"error": str(e)}
 
     def _mock_gen(self, prompt):
         """Return a mock purple image when model is not loaded."""
         img = Image.new("RGB", (512, 512), color=(200, 50, 200))
-        buffered = io.BytesIO()
-        img.save(buffered, format="PNG")
-        img_str = base64.b64encode(buffered.getvalue()).decode()
+        img_str = self._buffers.encode_b64(lambda buf: img.save(buf, format="PNG"))
         return {
             "created": int(time.time()),
             "data": [{"b64_json": img_str}],
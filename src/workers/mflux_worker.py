@@ -3,15 +3,26 @@ MFLUX Worker - MLX-native image generation using FLUX models.
 Supports both text-to-image and image-to-image generation.
 """
 
-import base64
-import io
+import gc
+import inspect
 import os
 import time
+from collections import OrderedDict
 from typing import Optional
-from PIL import Image
 from pydantic import BaseModel, Field
 
-from src.workers.base import BaseWorker, get_base_args
+from src.workers.base import (
+    FLUX_AGGRESSIVE_FREE, FLUX_WARMUP, STEP_PRESETS, BaseWorker, BufferPool, TaskQueue,
+    cap_edge, decode_base64_image, get_base_args, nearest_bucket, release_mlx_cache,
+    request_key,
+)
+
+# Approximate unified memory held by one 4-bit FLUX.1 variant
+FLUX_4BIT_GB = 7.0
+# Cap on resident FLUX variants. Defaults to one variant, which is what the
+# manager budgets for image-gen; 0 = keep every loaded variant
+MFLUX_MAX_RESIDENT_GB = float(os.getenv("MFLUX_MAX_RESIDENT_GB", str(FLUX_4BIT_GB)))
+DEFAULT_MODEL = "schnell"
 
 
 class GenerateRequest(BaseModel):
@@ -20,9 +31,13 @@ class GenerateRequest(BaseModel):
     n: int = 1
     size: str = "1024x1024"
     model: str = "schnell"  # schnell (fast) or dev (quality)
-    steps: Optional[int] = None  # None = auto (4 for schnell, 20 for dev)
+    steps: Optional[int] = None  # None = auto (preset, else 4 for schnell, 20 for dev)
+    preset: Optional[str] = Field(default=None, pattern="^(draft|standard|final)$")
     seed: Optional[int] = None
     guidance: float = 3.5
+    format: str = Field(default="JPEG", pattern="^(?i:png|jpe?g|webp)$")
+    quality: int = Field(default=90, ge=1, le=100)
+    wait: bool = True  # False = return a task_id to poll via /status and /image
 
 
 class EditRequest(BaseModel):
@@ -30,40 +45,94 @@ class EditRequest(BaseModel):
     prompt: str
     image: str  # Base64 encoded image
     strength: float = Field(default=0.7, ge=0.0, le=1.0)
-    size: Optional[str] = None  # None = keep original size
+    size: Optional[str] = None  # None = keep original size (after max_edge cap)
+    max_edge: int = Field(default=1024, ge=256, le=4096)  # Downscale larger inputs
     model: str = "schnell"
     steps: Optional[int] = None
+    preset: Optional[str] = Field(default=None, pattern="^(draft|standard|final)$")
     seed: Optional[int] = None
     guidance: float = 3.5
+    format: str = Field(default="JPEG", pattern="^(?i:png|jpe?g|webp)$")
+    quality: int = Field(default=90, ge=1, le=100)
+    wait: bool = True
 
 
 class MfluxWorker(BaseWorker):
     """Worker for MFLUX-based image generation."""
 
     def __init__(self, alias: str, model_path: str, socket_path: str = None, port: int = None):
-        self.flux = None
-        self._model_loaded = None
+        # Loaded variants by name, least recently used first
+        self._flux_cache: "OrderedDict[str, object]" = OrderedDict()
+        # model name -> generate_image kwarg for batched sampling (None = unsupported)
+        self._batch_kwarg: dict[str, Optional[str]] = {}
+        self.tasks = TaskQueue(after_job=release_mlx_cache if FLUX_AGGRESSIVE_FREE else None)
+        self._buffers = BufferPool()
         super().__init__(alias, model_path, socket_path, port)
 
-    def _load_model(self, model_name: str = "schnell"):
-        """Lazy load the FLUX model."""
-        if self._model_loaded == model_name:
-            return
+        try:
+            self._load_model(DEFAULT_MODEL)
+        except Exception as e:
+            print(f"[!] Model preload error: {e}")
+
+    def _load_model(self, model_name: str = DEFAULT_MODEL):
+        """Return the FLUX model for model_name, loading it on first use."""
+        flux = self._flux_cache.get(model_name)
+        if flux is not None:
+            self._flux_cache.move_to_end(model_name)
+            return flux
+
+        from mflux import Flux1
 
-        from mflux import Flux1, Config
+        self._evict_models(keep=FLUX_4BIT_GB)
 
         print(f"[*] Loading FLUX model: {model_name}")
         start = time.time()
 
         # Use 4-bit quantization for memory efficiency
-        self.flux = Flux1(
+        flux = Flux1(
             model_name=model_name,
             quantize=4,  # 4-bit quantization
         )
 
-        self._model_loaded = model_name
+        self._flux_cache[model_name] = flux
         print(f"[*] Model loaded in {time.time() - start:.2f}s")
 
+        params = inspect.signature(flux.generate_image).parameters
+        self._batch_kwarg[model_name] = next(
+            (k for k in ("batch_size", "num_images_per_prompt") if k in params), None
+        )
+
+        if FLUX_WARMUP:
+            try:
+                start = time.time()
+                flux.generate_image(
+                    prompt="warmup", width=256, height=256, num_steps=1, seed=0, guidance=0.0,
+                )
+                print(f"[+] FLUX warmup complete ({time.time() - start:.1f}s)")
+            except Exception as e:
+                print(f"[!] FLUX warmup failed: {e}")
+        return flux
+
+    def _evict_models(self, keep: float):
+        """Drop least recently used variants until `keep` GB more fits under the cap."""
+        if MFLUX_MAX_RESIDENT_GB <= 0:
+            return
+
+        evicted = False
+        while self._flux_cache and (len(self._flux_cache) * FLUX_4BIT_GB + keep > MFLUX_MAX_RESIDENT_GB):
+            name, _ = self._flux_cache.popitem(last=False)
+            print(f"[*] Unloading FLUX model: {name}")
+            evicted = True
+
+        if evicted:
+            gc.collect()
+            release_mlx_cache()
+
+    def _resolve_steps(self, model: str, steps: Optional[int], preset: Optional[str]) -> int:
+        """Explicit steps win; otherwise the preset, defaulting to "standard"."""
+        presets = STEP_PRESETS.get(model, STEP_PRESETS["dev"])
+        return steps or presets[preset or "standard"]
+
     def _parse_size(self, size_str: str) -> tuple[int, int]:
         """Parse size string like '1024x1024' to (width, height)."""
         parts = size_str.lower().split("x")
@@ -71,22 +140,9 @@ class MfluxWorker(BaseWorker):
             return 1024, 1024
         return int(parts[0]), int(parts[1])
 
-    def _image_to_base64(self, image: Image.Image) -> str:
-        """Convert PIL Image to base64 string."""
-        buffer = io.BytesIO()
-        image.save(buffer, format="PNG")
-        return base64.b64encode(buffer.getvalue()).decode("utf-8")
-
-    def _base64_to_image(self, b64_string: str) -> Image.Image:
-        """Convert base64 string to PIL Image."""
-        # Handle data URL format
-        if "," in b64_string:
-            b64_string = b64_string.split(",", 1)[1]
-        image_data = base64.b64decode(b64_string)
-        return Image.open(io.BytesIO(image_data))
-
     def _setup_routes(self):
         super()._setup_routes()
+        self._setup_task_routes(self.tasks)
 
         @self.app.post("/generate")
         async def generate(request: GenerateRequest):
@@ -103,38 +159,64 @@ class MfluxWorker(BaseWorker):
                 "seed": 42
             }
             """
-            try:
-                self._load_model(request.model)
+            steps = self._resolve_steps(request.model, request.steps, request.preset)
 
+            def run():
+                flux = self._load_model(request.model)
                 width, height = self._parse_size(request.size)
-                steps = request.steps or (4 if request.model == "schnell" else 20)
-
-                results = []
-                for i in range(request.n):
-                    seed = (request.seed + i) if request.seed else None
 
+                batch_kwarg = self._batch_kwarg.get(request.model)
+                if request.n > 1 and batch_kwarg:
+                    # One batched call: text encoding and per-step launches are shared
+                    seeds = [request.seed + i for i in range(request.n)] if request.seed is not None else None
                     start = time.time()
-                    image = self.flux.generate_image(
+                    output = flux.generate_image(
                         prompt=request.prompt,
                         width=width,
                         height=height,
                         num_steps=steps,
-                        seed=seed,
+                        seed=seeds,
                         guidance=request.guidance,
+                        **{batch_kwarg: request.n},
                     )
-                    elapsed = time.time() - start
-
-                    results.append({
-                        "b64_json": self._image_to_base64(image),
+                    images = list(output) if isinstance(output, (list, tuple)) else [output]
+                    print(f"[*] Generated {len(images)} images in {time.time() - start:.2f}s (batched)")
+                else:
+                    # Same prompt each iteration; mflux's prompt cache skips re-encoding
+                    images = []
+                    for i in range(request.n):
+                        seed = (request.seed + i) if request.seed is not None else None
+
+                        start = time.time()
+                        images.append(flux.generate_image(
+                            prompt=request.prompt,
+                            width=width,
+                            height=height,
+                            num_steps=steps,
+                            seed=seed,
+                            guidance=request.guidance,
+                        ))
+                        elapsed = time.time() - start
+                        print(f"[*] Generated image {i+1}/{request.n} in {elapsed:.2f}s")
+
+                results = [
+                    {
+                        "b64_json": self._buffers.encode_image(image, request.format, request.quality),
                         "revised_prompt": request.prompt,
-                    })
-                    print(f"[*] Generated image {i+1}/{request.n} in {elapsed:.2f}s")
+                    }
+                    for image in images
+                ]
 
                 return {
                     "created": int(time.time()),
                     "data": results,
                 }
 
+            try:
+                # Identical concurrent requests share one generation; only
+                # deterministic with an explicit seed
+                key = request_key(request.model_dump(exclude={"wait"})) if request.seed is not None else None
+                return await self._submit(self.tasks, run, steps * request.n, request.wait, key)
             except Exception as e:
                 return {"error": str(e)}, 500
 
@@ -152,28 +234,30 @@ class MfluxWorker(BaseWorker):
                 "steps": 4
             }
             """
-            try:
-                self._load_model(request.model)
+            steps = self._resolve_steps(request.model, request.steps, request.preset)
 
-                # Decode input image
-                input_image = self._base64_to_image(request.image)
+            def run():
+                flux = self._load_model(request.model)
+
+                # Decode input image; FLUX works around 1024, so cap oversize inputs
+                input_image = decode_base64_image(request.image)
+                original_size = input_image.size
+                input_image = cap_edge(input_image, request.max_edge)
 
                 # Determine output size
                 if request.size:
                     width, height = self._parse_size(request.size)
+                    # Ensure dimensions are multiples of 16 (required by FLUX)
+                    width = (width // 16) * 16
+                    height = (height // 16) * 16
                 else:
-                    width, height = input_image.size
-
-                # Ensure dimensions are multiples of 16 (required by FLUX)
-                width = (width // 16) * 16
-                height = (height // 16) * 16
-
-                steps = request.steps or (4 if request.model == "schnell" else 20)
+                    # Snap to the nearest aspect-ratio bucket (multiples of 64)
+                    width, height = nearest_bucket(*input_image.size)
 
                 start = time.time()
 
                 # img2img uses init_image and strength
-                output_image = self.flux.generate_image(
+                output_image = flux.generate_image(
                     prompt=request.prompt,
                     width=width,
                     height=height,
@@ -185,16 +269,21 @@ class MfluxWorker(BaseWorker):
                 )
 
                 elapsed = time.time() - start
-                print(f"[*] Edited image in {elapsed:.2f}s (strength={request.strength})")
+                print(
+                    f"[*] Edited image in {elapsed:.2f}s (strength={request.strength}, "
+                    f"{original_size[0]}x{original_size[1]} -> {width}x{height})"
+                )
 
                 return {
                     "created": int(time.time()),
                     "data": [{
-                        "b64_json": self._image_to_base64(output_image),
+                        "b64_json": self._buffers.encode_image(output_image, request.format, request.quality),
                         "revised_prompt": request.prompt,
                     }],
                 }
 
+            try:
+                return await self._submit(self.tasks, run, steps, request.wait)
             except Exception as e:
                 return {"error": str(e)}, 500
 
@@ -202,18 +291,25 @@ class MfluxWorker(BaseWorker):
         async def list_models():
             """List available FLUX models."""
             return {
+                "presets": {
+                    "draft": "About half the steps of standard: ~2x faster, softer detail",
+                    "standard": "Default step count",
+                    "final": "More steps for finer detail at proportionally higher latency",
+                },
                 "models": [
                     {
                         "id": "schnell",
                         "name": "FLUX.1-schnell",
                         "description": "Fast generation (4 steps), good for iteration",
                         "default_steps": 4,
+                        "presets": STEP_PRESETS["schnell"],
                     },
                     {
                         "id": "dev",
                         "name": "FLUX.1-dev",
                         "description": "High quality generation (20 steps)",
                         "default_steps": 20,
+                        "presets": STEP_PRESETS["dev"],
                     },
                 ]
             }
@@ -3,17 +3,28 @@ VLM Worker - Vision Language Model for image understanding.
 Uses mlx-vlm or Moondream for image-to-text tasks.
 
 Endpoints:
-- POST /chat - OpenAI-compatible chat completion with vision
+- POST /chat - OpenAI-compatible chat completion with vision ("stream": true for SSE)
 - POST /analyze - Structured image analysis with predefined tasks
 - GET /tasks - List available analysis tasks
 """
 
 import sys
-import base64
+import asyncio
+import functools
+import hashlib
 import io
+import logging
+import json
+import threading
 import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncIterator, Callable, Iterable
+from fastapi.responses import StreamingResponse
 from PIL import Image
-from src.workers.base import BaseWorker, get_base_args
+from src.workers.base import BaseWorker, decode_base64_data, get_base_args
+
+logger = logging.getLogger(__name__)
 
 # Conditionally import MLX related libs to avoid crashes if not installed during setup
 try:
@@ -25,6 +36,52 @@ except ImportError:
     load_vlm = None
     md = None
 
+try:
+    from mlx_vlm import stream_generate as stream_vlm
+except ImportError:
+    stream_vlm = None
+
+# Task-specific prompts for /analyze ("custom" uses the request's prompt)
+_TASK_PROMPTS = {
+    "caption": "Provide a brief, one-sentence caption for this image.",
+    "ocr": "Extract and return all text visible in this image. Return only the extracted text, nothing else.",
+    "describe": "Describe this image in detail, including objects, colors, composition, and mood.",
+    "analyze": """Analyze this image comprehensively. Include:
+1) Main subject
+2) Objects and their positions
+3) Colors and lighting
+4) Any text visible
+5) Overall context or meaning""",
+    "objects": "List all objects visible in this image, one per line.",
+}
+# Truncated form reported back in usage.prompt_used
+_TASK_PROMPTS_SHORT = {
+    k: v[:100] + "..." if len(v) > 100 else v for k, v in _TASK_PROMPTS.items()
+}
+
+# Moondream image encodings kept for reuse (multi-turn chat, several tasks per image)
+MD_ENCODE_CACHE_SIZE = 16
+
+
+def _open_image(data: bytes) -> Image.Image:
+    """Decode image bytes eagerly to RGB (PIL is lazy), for use in a worker thread.
+
+    Both backends want RGB; normalizing here lets them skip their own mode
+    conversion, and images that are already RGB are returned without a copy.
+    """
+    image = Image.open(io.BytesIO(data))
+    image.load()
+    return image if image.mode == "RGB" else image.convert("RGB")
+
+
+def _task_prompt(task: str, custom_prompt: str = "") -> tuple:
+    """(prompt, prompt_used) for an /analyze task; unknown tasks fall back to caption."""
+    if task == "custom":
+        prompt = custom_prompt or "Describe this image."
+        return prompt, prompt[:100] + "..." if len(prompt) > 100 else prompt
+    key = task if task in _TASK_PROMPTS else "caption"
+    return _TASK_PROMPTS[key], _TASK_PROMPTS_SHORT[key]
+
 
 class VLMWorker(BaseWorker):
     """
@@ -40,9 +97,14 @@ class VLMWorker(BaseWorker):
 
     def __init__(self, alias, model_path, socket_path=None, port=None):
         super().__init__(alias, model_path, socket_path, port)
+        # Every model call runs on this one thread: Moondream and MLX models are
+        # not thread-safe, and streamed and non-streamed requests share them
+        self._model_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"{alias}-model")
         self.model = None
         self.processor = None
         self.md_model = None  # For official moondream library
+        # blake2b(image bytes) -> encoded image, least recently used first
+        self._img_cache: "OrderedDict[bytes, Any]" = OrderedDict()
         self._load_model()
 
     def _load_model(self):
@@ -70,6 +132,21 @@ class VLMWorker(BaseWorker):
             self.model, self.processor = load_vlm(self.model_path)
             print(f"[+] Model {self.alias} loaded successfully.")
 
+    async def _md_encode(self, image_data: bytes):
+        """Moondream-encode image bytes, reusing the encoding for repeated images."""
+        key = hashlib.blake2b(image_data, digest_size=16).digest()
+        encoded = self._img_cache.get(key)
+        if encoded is not None:
+            self._img_cache.move_to_end(key)
+            return encoded
+
+        pil_image = await asyncio.to_thread(_open_image, image_data)
+        encoded = await self._run_model(self.md_model.encode_image, pil_image)
+        self._img_cache[key] = encoded
+        if len(self._img_cache) > MD_ENCODE_CACHE_SIZE:
+            self._img_cache.popitem(last=False)
+        return encoded
+
     def _setup_routes(self):
         super()._setup_routes()
 
@@ -91,33 +168,44 @@ class VLMWorker(BaseWorker):
                         elif part["type"] == "image_url":
                             img_url = part["image_url"]["url"]
                             if img_url.startswith("data:image"):
-                                _, b64 = img_url.split(",", 1)
-                                image_data = base64.b64decode(b64)
+                                image_data = await asyncio.to_thread(decode_base64_data, img_url)
+
+            stream = request.get("stream", False)
 
             # --- Case 1: Moondream Official Lib ---
             if self.md_model:
-                pil_image = Image.open(io.BytesIO(image_data)) if image_data else None
                 start_time = time.time()
 
-                if pil_image:
-                    encoded_img = self.md_model.encode_image(pil_image)
-                    output = self.md_model.query(encoded_img, prompt)["answer"]
+                if stream:
+                    args = (await self._md_encode(image_data), prompt) if image_data else (prompt,)
+                    return self._stream_response(lambda: self._md_stream(*args))
+
+                if image_data:
+                    encoded_img = await self._md_encode(image_data)
+                    output = (await self._run_model(self.md_model.query, encoded_img, prompt))["answer"]
                 else:
-                    output = self.md_model.query(prompt)["answer"]
+                    output = (await self._run_model(self.md_model.query, prompt))["answer"]
 
                 latency = time.time() - start_time
                 return self._format_response(output, latency)
 
             # --- Case 2: MLX-VLM ---
             if self.model:
-                pil_image = Image.open(io.BytesIO(image_data)) if image_data else None
+                pil_image = await asyncio.to_thread(_open_image, image_data) if image_data else None
+
+                if stream:
+                    return self._stream_response(lambda: self._vlm_stream(pil_image, prompt, 512))
+
                 start_time = time.time()
-                output = generate_vlm(
-                    self.model, self.processor, pil_image, prompt, max_tokens=512
+                output = await self._run_model(
+                    generate_vlm, self.model, self.processor, pil_image, prompt, max_tokens=512
                 )
                 latency = time.time() - start_time
                 return self._format_response(output, latency)
 
+            if stream:
+                mock = self._mock_response(prompt)["choices"][0]["message"]["content"]
+                return self._stream_response(lambda: [mock])
             return self._mock_response(prompt)
 
         @self.app.post("/analyze")
@@ -141,40 +229,23 @@ class VLMWorker(BaseWorker):
             if not image_b64:
                 return {"error": "image field is required"}
 
-            # Task-specific prompts
-            task_prompts = {
-                "caption": "Provide a brief, one-sentence caption for this image.",
-                "ocr": "Extract and return all text visible in this image. Return only the extracted text, nothing else.",
-                "describe": "Describe this image in detail, including objects, colors, composition, and mood.",
-                "analyze": """Analyze this image comprehensively. Include:
-1) Main subject
-2) Objects and their positions
-3) Colors and lighting
-4) Any text visible
-5) Overall context or meaning""",
-                "objects": "List all objects visible in this image, one per line.",
-                "custom": custom_prompt or "Describe this image.",
-            }
-
-            prompt = task_prompts.get(task, task_prompts["caption"])
+            prompt, prompt_used = _task_prompt(task, custom_prompt)
 
             try:
                 # Decode image
-                if "," in image_b64:
-                    image_b64 = image_b64.split(",", 1)[1]
-                image_data = base64.b64decode(image_b64)
-                pil_image = Image.open(io.BytesIO(image_data))
+                image_data = await asyncio.to_thread(decode_base64_data, image_b64)
 
                 start_time = time.time()
 
                 # Use Moondream if available
                 if self.md_model:
-                    encoded_img = self.md_model.encode_image(pil_image)
-                    output = self.md_model.query(encoded_img, prompt)["answer"]
+                    encoded_img = await self._md_encode(image_data)
+                    output = (await self._run_model(self.md_model.query, encoded_img, prompt))["answer"]
                 # Use MLX-VLM
                 elif self.model:
-                    output = generate_vlm(
-                        self.model, self.processor, pil_image, prompt, max_tokens=max_tokens
+                    pil_image = await asyncio.to_thread(_open_image, image_data)
+                    output = await self._run_model(
+                        generate_vlm, self.model, self.processor, pil_image, prompt, max_tokens=max_tokens
                     )
                 else:
                     output = f"Mock analysis for task: {task}"
@@ -188,13 +259,77 @@ class VLMWorker(BaseWorker):
                     "model": self.model_path,
                     "usage": {
                         "latency": latency,
-                        "prompt_used": prompt[:100] + "..." if len(prompt) > 100 else prompt,
+                        "prompt_used": prompt_used,
                     },
                 }
 
             except Exception as e:
-                import traceback
-                traceback.print_exc()
+                logger.exception("Analysis error: %s", e)
+                return {"error": str(e)}
+
+        @self.app.post("/analyze_batch")
+        async def analyze_batch(request: dict):
+            """
+            Several /analyze tasks on one image, decoding and encoding it once.
+
+            POST /analyze_batch
+            {
+                "image": "<base64 encoded image>",
+                "tasks": ["caption", "ocr", "describe"],
+                "prompt": "optional custom prompt for 'custom' task",
+                "max_tokens": 512
+            }
+            """
+            image_b64 = request.get("image", "")
+            tasks = request.get("tasks") or ["caption"]
+            custom_prompt = request.get("prompt", "")
+            max_tokens = request.get("max_tokens", 512)
+
+            if not image_b64:
+                return {"error": "image field is required"}
+
+            try:
+                image_data = await asyncio.to_thread(decode_base64_data, image_b64)
+
+                start_time = time.time()
+                if self.md_model:
+                    encoded_img = await self._md_encode(image_data)
+
+                    def run(prompt):
+                        return self.md_model.query(encoded_img, prompt)["answer"]
+                elif self.model:
+                    pil_image = await asyncio.to_thread(_open_image, image_data)
+
+                    def run(prompt):
+                        return generate_vlm(
+                            self.model, self.processor, pil_image, prompt, max_tokens=max_tokens
+                        )
+                else:
+                    run = None
+
+                results = []
+                for task in tasks:
+                    prompt, prompt_used = _task_prompt(task, custom_prompt)
+                    task_start = time.time()
+                    output = await self._run_model(run, prompt) if run else f"Mock analysis for task: {task}"
+                    results.append({
+                        "task": task,
+                        "result": output,
+                        "usage": {
+                            "latency": time.time() - task_start,
+                            "prompt_used": prompt_used,
+                        },
+                    })
+
+                return {
+                    "results": results,
+                    "created": int(time.time()),
+                    "model": self.model_path,
+                    "usage": {"latency": time.time() - start_time},
+                }
+
+            except Exception as e:
+                logger.exception("Analysis error: %s", e)
                 return {"error": str(e)}
 
         @self.app.get("/tasks")
@@ -211,6 +346,65 @@ class VLMWorker(BaseWorker):
                 ]
             }
 
+    def _md_stream(self, *args) -> Iterable[str]:
+        """Moondream answer as text chunks (whole answer if the lib cannot stream)."""
+        try:
+            answer = self.md_model.query(*args, stream=True)["answer"]
+        except TypeError:
+            answer = self.md_model.query(*args)["answer"]
+        return [answer] if isinstance(answer, str) else answer
+
+    def _vlm_stream(self, pil_image, prompt, max_tokens) -> Iterable[str]:
+        """mlx-vlm output as text chunks (whole output if stream_generate is missing)."""
+        if stream_vlm is None:
+            return [generate_vlm(self.model, self.processor, pil_image, prompt, max_tokens=max_tokens)]
+        chunks = stream_vlm(self.model, self.processor, pil_image, prompt, max_tokens=max_tokens)
+        # Newer mlx-vlm yields result objects, older ones plain strings
+        return (getattr(chunk, "text", chunk) for chunk in chunks)
+
+    async def _run_model(self, fn: Callable, *args, **kwargs):
+        """Run a blocking model call on the model thread."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._model_executor, functools.partial(fn, *args, **kwargs))
+
+    async def _model_chunks(self, make_chunks: Callable[[], Iterable[str]]) -> AsyncIterator[str]:
+        """
+        Iterate make_chunks() on the model thread, yielding chunks as they arrive.
+
+        The whole stream is one model-thread job, so it never interleaves with
+        other model calls; a client disconnect stops it at the next chunk.
+        """
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue()
+        done = object()
+        stop = threading.Event()
+
+        def produce():
+            try:
+                for chunk in make_chunks():
+                    if stop.is_set():
+                        break
+                    loop.call_soon_threadsafe(queue.put_nowait, chunk)
+            except Exception as e:
+                loop.call_soon_threadsafe(queue.put_nowait, e)
+            finally:
+                loop.call_soon_threadsafe(queue.put_nowait, done)
+
+        loop.run_in_executor(self._model_executor, produce)
+        try:
+            while (item := await queue.get()) is not done:
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            stop.set()
+
+    def _stream_response(self, make_chunks: Callable[[], Iterable[str]]) -> StreamingResponse:
+        """SSE response for the chunks of make_chunks(), produced on the model thread."""
+        return StreamingResponse(
+            _sse_events(self._model_chunks(make_chunks)), media_type="text/event-stream"
+        )
+
     def _format_response(self, content, latency):
         return {
             "choices": [
@@ -236,6 +430,23 @@ class VLMWorker(BaseWorker):
         }
 
 
+async def _sse_events(chunks: AsyncIterator[str]) -> AsyncIterator[str]:
+    """OpenAI-style chat.completion.chunk events, ending with [DONE]."""
+    def event(delta: dict, finish_reason=None) -> str:
+        payload = {
+            "object": "chat.completion.chunk",
+            "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+        }
+        return f"data: {json.dumps(payload)}\n\n"
+
+    yield event({"role": "assistant"})
+    async for chunk in chunks:
+        if chunk:
+            yield event({"content": chunk})
+    yield event({}, "stop")
+    yield "data: [DONE]\n\n"
+
+
 if __name__ == "__main__":
     args = get_base_args()
     worker = VLMWorker(args.alias, args.model_path, args.socket, args.port)
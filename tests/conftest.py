@@ -0,0 +1,36 @@
+import asyncio
+
+import pytest
+
+import src.worker_manager as wm
+
+
+class AliveProcess:
+    """Popen stand-in for a worker that keeps running."""
+
+    pid = 1
+
+    def __init__(self, *args, **kwargs):
+        self.args = args
+
+    def poll(self):
+        return None
+
+    def wait(self, timeout=None):
+        return 0
+
+    def terminate(self):
+        pass
+
+    def kill(self):
+        pass
+
+
+@pytest.fixture
+def manager(monkeypatch, tmp_path):
+    """WorkerManager with its logs under tmp_path and no real processes or memory checks."""
+    monkeypatch.setattr(wm, "PROJECT_ROOT", tmp_path)
+    monkeypatch.setattr(wm, "can_load_model", lambda *args: (True, 1.0, 64.0))
+    m = wm.WorkerManager()
+    yield m
+    asyncio.run(m._health_client.aclose())
@@ -0,0 +1,26 @@
+import os
+import shutil
+from pathlib import Path
+
+import yaml
+
+from src.core.config import _cache_path, load_config
+
+REPO_CONFIG = Path(__file__).parent.parent / "config.yaml"
+
+
+def test_stale_sidecar_is_ignored_after_the_yaml_changes(tmp_path, monkeypatch):
+    monkeypatch.delenv("GATEWAY_PORT", raising=False)
+    path = tmp_path / "config.yaml"
+    shutil.copy(REPO_CONFIG, path)
+    first = load_config(str(path))
+    sidecar = _cache_path(path).read_bytes()
+
+    data = yaml.safe_load(path.read_text())
+    data["gateway"]["port"] = first.gateway.port + 1
+    path.write_text(yaml.safe_dump(data))
+    # An edit that leaves the YAML looking older than its sidecar (copy/restore)
+    os.utime(path, (0, 0))
+
+    assert load_config(str(path)).gateway.port == first.gateway.port + 1
+    assert _cache_path(path).read_bytes() != sidecar
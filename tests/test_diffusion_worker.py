@@ -0,0 +1,109 @@
+import asyncio
+import threading
+import time
+
+import httpx
+from PIL import Image
+
+from src.workers.base import FLUX_BUCKETS, cap_edge, nearest_bucket
+from src.workers.diffusion_worker import DiffusionWorker
+
+
+class FakeFlux:
+    """Stands in for mflux's Flux1: counts calls, slow enough to overlap."""
+
+    def __init__(self):
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def generate_image(self, seed, prompt, width, height, num_inference_steps, guidance, **kwargs):
+        with self._lock:
+            self.calls += 1
+        time.sleep(0.05)
+        return Image.new("RGB", (width, height), color=(seed % 256, 0, 0))
+
+
+def _worker():
+    worker = DiffusionWorker("image-gen", "mlx-community/FLUX.1-schnell-4bit-mlx")
+    worker.flux = FakeFlux()
+    worker._model_type = "schnell"
+    return worker
+
+
+async def _generate_twice(worker, seed):
+    body = {"prompt": "a cat", "size": "64x64", "seed": seed}
+    transport = httpx.ASGITransport(app=worker.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://worker") as client:
+        return await asyncio.gather(
+            client.post("/generate", json=body),
+            client.post("/generate", json=body),
+        )
+
+
+def test_unseeded_concurrent_requests_are_not_merged():
+    worker = _worker()
+    responses = asyncio.run(_generate_twice(worker, None))
+    assert worker.flux.calls == 2
+    for r in responses:
+        assert r.status_code == 200
+        assert r.json()["usage"]["seed"] is not None
+
+
+def test_seeded_concurrent_requests_share_one_generation():
+    worker = _worker()
+    a, b = asyncio.run(_generate_twice(worker, 42))
+    assert worker.flux.calls == 1
+    assert a.json()["data"] == b.json()["data"]
+
+
+def test_resolve_steps_defaults_to_standard_preset():
+    worker = _worker()
+    worker._model_type = "dev"
+    assert worker._resolve_steps({}) == 20
+    assert worker._resolve_steps({"preset": "draft"}) == 10
+    assert worker._resolve_steps({"steps": 7, "preset": "final"}) == 7
+
+
+def test_unknown_preset_is_a_bad_request():
+    worker = _worker()
+    transport = httpx.ASGITransport(app=worker.app)
+
+    async def post(preset):
+        async with httpx.AsyncClient(transport=transport, base_url="http://worker") as client:
+            return await client.post("/generate", json={"prompt": "a cat", "preset": preset})
+
+    assert asyncio.run(post("ultra")).status_code == 400
+    assert asyncio.run(post(["draft"])).status_code == 400
+
+
+def test_cap_edge_keeps_extreme_aspect_ratios_nonempty():
+    capped = cap_edge(Image.new("RGB", (4000, 1)), max_edge=1024)
+    assert capped.size == (1024, 1)
+
+
+def test_nearest_bucket_handles_zero_height():
+    assert nearest_bucket(1024, 0) in FLUX_BUCKETS
+
+
+def test_named_quantization_falls_back_to_bits_on_int_only_mflux(monkeypatch):
+    import src.workers.diffusion_worker as dw
+
+    class IntOnlyFlux1(FakeFlux):
+        def __init__(self, model_config, quantize: int | None = None):
+            super().__init__()
+            self.quantize = quantize
+
+    class ModelConfig:
+        @staticmethod
+        def from_name(model_name):
+            return model_name
+
+    monkeypatch.setattr(dw, "Flux1", IntOnlyFlux1)
+    monkeypatch.setattr(dw, "ModelConfig", ModelConfig)
+    monkeypatch.setattr(dw, "MFLUX_AVAILABLE", True)
+
+    assert dw.parse_quantization("x/FLUX.1-dev-nf4") == "nf4"
+    worker = DiffusionWorker("image-gen", "x/FLUX.1-dev-nf4")
+    assert worker._quantize == 4
+    assert worker.flux.quantize == 4
+    assert worker.flux.calls == 0  # no probe generation
@@ -0,0 +1,23 @@
+from fastapi.testclient import TestClient
+from fastapi.responses import JSONResponse
+
+import src.gateway.main as gateway
+
+
+def test_analyze_batch_validates_tasks(monkeypatch):
+    forwarded = []
+
+    async def forward(alias, path, payload, timeout):
+        forwarded.append(payload)
+        return JSONResponse({"results": []})
+
+    monkeypatch.setattr(gateway, "_forward", forward)
+    c = TestClient(gateway.app)
+    image = "aGk="
+
+    assert c.post("/v1/vision/analyze_batch", json={"image": image, "tasks": ["caption", "ocr"]}).status_code == 200
+    assert c.post("/v1/vision/analyze_batch", json={"image": image, "tasks": []}).status_code == 422
+    assert c.post("/v1/vision/analyze_batch", json={"image": image, "tasks": ["nope"]}).status_code == 422
+    too_many = ["caption"] * (gateway.MAX_BATCH_TASKS + 1)
+    assert c.post("/v1/vision/analyze_batch", json={"image": image, "tasks": too_many}).status_code == 422
+    assert [p["tasks"] for p in forwarded] == [["caption", "ocr"]]
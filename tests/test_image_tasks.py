@@ -0,0 +1,93 @@
+import asyncio
+import functools
+import threading
+import time
+
+import httpx
+from fastapi.testclient import TestClient
+from PIL import Image
+
+import src.worker_manager as wm
+from src.core.supervisor import WorkerInfo, supervisor
+from src.gateway.main import app
+from src.workers.diffusion_worker import DiffusionWorker
+from tests.conftest import AliveProcess
+
+
+class BlockingFlux:
+    """Flux stand-in whose generation waits until released."""
+
+    def __init__(self):
+        self.release = threading.Event()
+
+    def generate_image(self, seed, prompt, width, height, num_inference_steps, guidance, **kwargs):
+        self.release.wait(5)
+        return Image.new("RGB", (width, height))
+
+
+def test_polling_a_task_does_not_acquire_the_worker(monkeypatch):
+    worker = DiffusionWorker("image-gen", "mlx-community/FLUX.1-schnell-4bit-mlx")
+    worker.flux = BlockingFlux()
+    worker._model_type = "schnell"
+    worker_client = httpx.AsyncClient(transport=httpx.ASGITransport(app=worker.app), base_url="http://w")
+
+    async def locate_worker(alias):
+        return WorkerInfo(alias=alias, address="http://w", port=8003, memory_gb=6.0)
+
+    async def get_worker(alias):
+        raise AssertionError("polling must not acquire the worker")
+
+    monkeypatch.setattr(supervisor, "locate_worker", locate_worker)
+    monkeypatch.setattr(supervisor, "get_worker", get_worker)
+    monkeypatch.setattr(supervisor, "get_client", lambda address: worker_client)
+
+    with TestClient(app) as c:
+        body = {"prompt": "a cat", "size": "64x64", "wait": False}
+        task_id = c.portal.call(
+            functools.partial(worker_client.post, "/generate", json=body)
+        ).json()["task_id"]
+        assert c.get("/v1/images/tasks/unknown").status_code == 404
+        assert c.get(f"/v1/images/tasks/{task_id}").status_code == 202
+        assert c.portal.call(worker_client.get, "/health").json()["pending"] == 1
+
+        worker.flux.release.set()
+        for _ in range(100):
+            r = c.get(f"/v1/images/tasks/{task_id}")
+            if r.status_code == 200:
+                break
+            time.sleep(0.02)
+        assert r.status_code == 200
+        assert r.json()["data"][0]["b64_json"]
+
+
+def test_monitor_does_not_recycle_a_worker_with_pending_tasks(manager, monkeypatch):
+    monkeypatch.setattr(wm, "HEALTH_CHECK_INTERVAL", 0.01)
+    stopped = []
+    pending = {"n": 1}
+
+    async def stop_worker(alias):
+        stopped.append(alias)
+        manager.workers.pop(alias, None)
+        return True
+
+    async def pending_tasks(port):
+        return pending["n"]
+
+    manager.stop_worker = stop_worker
+    manager._pending_tasks = pending_tasks
+
+    async def scenario():
+        manager.workers["image-gen"] = wm.WorkerProcess(
+            "image-gen", AliveProcess(), 8003, "p", "diffusion", 6.0,
+            request_count=wm.MAX_REQUESTS_BEFORE_RESTART,
+        )
+        manager._running = True
+        monitor = asyncio.create_task(manager._monitor_idle_workers())
+        await asyncio.sleep(0.05)
+        assert stopped == []
+        pending["n"] = 0
+        await asyncio.sleep(0.05)
+        monitor.cancel()
+
+    asyncio.run(scenario())
+    assert stopped == ["image-gen"]
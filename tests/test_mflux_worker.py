@@ -0,0 +1,58 @@
+import asyncio
+import threading
+import time
+
+import httpx
+from PIL import Image
+
+from src.workers.mflux_worker import FLUX_4BIT_GB, MfluxWorker
+
+
+class FakeFlux:
+    """Records the seed of every generation; slow enough for requests to overlap."""
+
+    def __init__(self):
+        self.seeds = []
+        self._lock = threading.Lock()
+
+    def generate_image(self, **kwargs):
+        with self._lock:
+            self.seeds.append(kwargs["seed"])
+        time.sleep(0.05)
+        return Image.new("RGB", (8, 8))
+
+
+def _worker():
+    worker = MfluxWorker("image-gen", "mflux")
+    worker._flux_cache["schnell"] = FakeFlux()
+    worker._batch_kwarg["schnell"] = None
+    return worker
+
+
+async def _generate(worker, *bodies):
+    transport = httpx.ASGITransport(app=worker.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://worker") as client:
+        return await asyncio.gather(*(client.post("/generate", json=b) for b in bodies))
+
+
+def test_seed_zero_is_an_explicit_seed():
+    worker = _worker()
+    body = {"prompt": "a cat", "seed": 0, "n": 2}
+    a, b = asyncio.run(_generate(worker, body, body))
+    assert a.status_code == b.status_code == 200
+    # Deterministic, so the identical requests share one job seeded 0, 1
+    assert worker._flux_cache["schnell"].seeds == [0, 1]
+    assert a.json()["data"] == b.json()["data"]
+
+
+def test_unseeded_requests_are_not_merged():
+    worker = _worker()
+    body = {"prompt": "a cat"}
+    asyncio.run(_generate(worker, body, body))
+    assert worker._flux_cache["schnell"].seeds == [None, None]
+
+
+def test_one_variant_resident_by_default():
+    worker = _worker()
+    worker._evict_models(keep=FLUX_4BIT_GB)  # about to load "dev"
+    assert list(worker._flux_cache) == []
@@ -0,0 +1,58 @@
+import asyncio
+import time
+
+import pytest
+
+from src.core.config import get_config
+from src.core.supervisor import Supervisor, WorkerInfo, WorkerManagerError
+
+
+@pytest.fixture
+def supervisor(monkeypatch):
+    """Supervisor with a cached vlm-fast handle that records manager calls instead of sending them."""
+    monkeypatch.setattr(get_config().workers, "touch_ttl", 0.05)
+    monkeypatch.setattr(Supervisor, "_touch_batch_unsupported", False)
+    sup = Supervisor()
+    sup.calls = []
+    sup.workers["vlm-fast"] = WorkerInfo(alias="vlm-fast", address="http://w", port=8001, memory_gb=2.0)
+
+    async def call_manager(method, path, **kwargs):
+        sup.calls.append((path, kwargs.get("json")))
+        return {}
+
+    sup._call_manager = call_manager
+    return sup
+
+
+async def _serve_from_cache(sup, n):
+    for _ in range(n):
+        await sup.get_worker("vlm-fast")
+    # Let the periodic flusher run once
+    await asyncio.sleep(0.08)
+
+
+def test_cached_hits_are_flushed_as_one_batch(supervisor):
+    asyncio.run(_serve_from_cache(supervisor, 3))
+    assert supervisor.calls == [("/touch-batch", {"events": [{"alias": "vlm-fast", "n": 3}]})]
+    assert supervisor._pending_touches == {}
+
+
+def test_flush_falls_back_to_single_touches_without_touch_batch(supervisor):
+    record = supervisor._call_manager
+
+    async def call_manager(method, path, **kwargs):
+        await record(method, path, **kwargs)
+        if path == "/touch-batch":
+            raise WorkerManagerError(404, "Not Found")
+        return {}
+
+    supervisor._call_manager = call_manager
+    asyncio.run(_serve_from_cache(supervisor, 2))
+    assert [path for path, _ in supervisor.calls] == ["/touch-batch", "/touch/vlm-fast"]
+    assert Supervisor._touch_batch_unsupported
+
+    # Later flushes go straight to the per-alias endpoint
+    supervisor.calls.clear()
+    supervisor.workers["vlm-fast"].last_used = time.time()
+    asyncio.run(_serve_from_cache(supervisor, 1))
+    assert [path for path, _ in supervisor.calls] == ["/touch/vlm-fast"]
@@ -0,0 +1,48 @@
+import asyncio
+
+from src.workers.base import TaskQueue
+
+
+def _job(size):
+    return lambda: "x" * size
+
+
+def test_waited_results_are_not_retained():
+    async def scenario():
+        q = TaskQueue()
+        for _ in range(5):
+            state = q.submit(_job(1_000_000), 1)
+            assert len(await state.future) == 1_000_000
+        return q
+
+    assert asyncio.run(scenario()).tasks == {}
+
+
+def test_polled_result_is_kept_until_delivered_or_expired():
+    async def scenario():
+        q = TaskQueue()
+        kept = q.submit(_job(10), 1, keep=True)
+        expiring = q.submit(_job(10), 1, keep=True)
+        await asyncio.gather(kept.future, expiring.future)
+        assert q.status(kept.task_id)["status"] == "done"
+
+        expiring.finished -= q.RESULT_TTL_SECONDS + 1
+        q._prune()
+        return q, kept, expiring
+
+    q, kept, expiring = asyncio.run(scenario())
+    assert kept.task_id in q.tasks
+    assert expiring.task_id not in q.tasks
+
+
+def test_deduped_polling_submitter_keeps_the_result():
+    async def scenario():
+        q = TaskQueue()
+        waited = q.submit(_job(10), 1, key="k")
+        polled = q.submit(_job(10), 1, key="k", keep=True)
+        assert polled is waited
+        await waited.future
+        return q, polled
+
+    q, polled = asyncio.run(scenario())
+    assert polled.task_id in q.tasks
@@ -0,0 +1,86 @@
+import asyncio
+import base64
+import io
+import threading
+import time
+
+import httpx
+from PIL import Image
+
+from src.workers.vlm_worker import VLMWorker
+
+
+class FakeMoondream:
+    """Moondream stand-in that records how many calls ever overlapped."""
+
+    def __init__(self):
+        self.active = 0
+        self.max_active = 0
+        self._lock = threading.Lock()
+
+    def _enter(self):
+        with self._lock:
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        time.sleep(0.02)
+
+    def _exit(self):
+        with self._lock:
+            self.active -= 1
+
+    def encode_image(self, image):
+        self._enter()
+        self._exit()
+        return image.size
+
+    def query(self, *args, stream=False):
+        if not stream:
+            self._enter()
+            self._exit()
+            return {"answer": "a cat"}
+
+        def chunks():
+            self._enter()
+            try:
+                for word in ("a ", "streamed ", "cat"):
+                    time.sleep(0.01)
+                    yield word
+            finally:
+                self._exit()
+
+        return {"answer": chunks()}
+
+
+def _image_b64():
+    buf = io.BytesIO()
+    Image.new("RGB", (8, 8)).save(buf, "PNG")
+    return base64.b64encode(buf.getvalue()).decode()
+
+
+def test_stream_and_non_stream_model_calls_never_overlap():
+    worker = VLMWorker("vlm-fast", "vikhyatk/moondream2")
+    worker.md_model = FakeMoondream()
+    image = _image_b64()
+
+    def chat(stream, n):
+        return {
+            "stream": stream,
+            "messages": [{"role": "user", "content": [
+                {"type": "text", "text": f"what is this {n}"},
+                {"type": "image_url", "image_url": {"url": f"data:image/png;base64,{image}"}},
+            ]}],
+        }
+
+    async def scenario():
+        transport = httpx.ASGITransport(app=worker.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://worker") as client:
+            return await asyncio.gather(
+                *(client.post("/chat", json=chat(n % 2 == 0, n)) for n in range(6)),
+                client.post("/analyze", json={"image": image, "task": "ocr"}),
+            )
+
+    responses = asyncio.run(scenario())
+    assert all(r.status_code == 200 for r in responses)
+    assert worker.md_model.max_active == 1
+    streamed = responses[0].text
+    assert '"content": "streamed "' in streamed and streamed.endswith("data: [DONE]\n\n")
@@ -0,0 +1,66 @@
+import asyncio
+
+import src.worker_manager as wm
+from tests.conftest import AliveProcess
+
+
+def test_concurrent_spawns_start_one_process(manager, monkeypatch):
+    launched = []
+
+    def popen(*args, **kwargs):
+        launched.append(args)
+        return AliveProcess(*args)
+
+    async def is_worker_healthy(port, timeout=2.0):
+        return bool(launched)
+
+    monkeypatch.setattr(wm.subprocess, "Popen", popen)
+    manager._is_worker_healthy = is_worker_healthy
+
+    async def scenario():
+        return await asyncio.gather(*(manager.spawn_worker("vlm-fast") for _ in range(5)))
+
+    workers = asyncio.run(scenario())
+    assert len(launched) == 1
+    assert all(w is workers[0] for w in workers)
+    assert manager._spawn_inflight == {}
+
+
+def test_retouched_worker_keeps_one_deadline_and_offloads_once(manager, monkeypatch):
+    monkeypatch.setattr(wm, "IDLE_TIMEOUT_SECONDS", 0.05)
+    stopped = []
+
+    async def stop_worker(alias):
+        stopped.append(alias)
+        manager.workers.pop(alias, None)
+        return True
+
+    async def pending_tasks(port):
+        return 0
+
+    manager.stop_worker = stop_worker
+    manager._pending_tasks = pending_tasks
+
+    async def scenario():
+        manager.workers["vlm-fast"] = wm.WorkerProcess(
+            "vlm-fast", AliveProcess(), 8001, "p", "vlm", 2.0
+        )
+        manager._schedule_idle("vlm-fast")
+        for _ in range(10):
+            manager.touch_worker("vlm-fast")
+        assert manager._deadlines.qsize() == 1
+
+        manager._running = True
+        offloader = asyncio.create_task(manager._offload_idle_workers())
+        for _ in range(10):
+            manager.touch_worker("vlm-fast")
+            assert manager._deadlines.qsize() <= 1
+            await asyncio.sleep(0.01)
+        assert stopped == []
+        await asyncio.sleep(0.15)
+        offloader.cancel()
+
+    asyncio.run(scenario())
+    assert stopped == ["vlm-fast"]
+    assert manager._deadlines.empty()
+    assert manager._deadline_armed == set()